@@ -5,9 +5,14 @@ Functions to simulate agent behaviour.
 """
 
 import bisect
+import collections
+import itertools
 import logging
+import multiprocessing
 import sys
 import lib.io as io
+import lib.metrics as metrics
+import lib.profiler as prof
 import lib.statistics as stat
 
 logger = logging.getLogger(__name__)
@@ -15,25 +20,58 @@ logger = logging.getLogger(__name__)
 FEE = 0.0065
 
 
-def _getBuyCriteria1(_trade_price, _future_trade_price, _traded_amount, _bought):
+def _getPriceLevel(_trade_price, _book_tick_size):
+    """
+    Maps a trade price to its price level in an aggregated book.
+
+    :param _trade_price: (float) price of the trade
+    :param _book_tick_size: (float) width of a price level, 0 to keep exact prices
+    :return: (float) price level
+    """
+    try:
+        if _book_tick_size:
+            return round(_trade_price / _book_tick_size) * _book_tick_size
+
+        return _trade_price
+
+    except:
+        raise
+
+
+def _getBuyCriteria1(_trade_price, _future_trade_price, _traded_amount, _bought, _book_tick_size=None):
     """
     Decides when an agent in the market has bought the financial instrument.
 
     Every trade transfers the financial instrument from one agent to another. Here we accumulate what every agent has
-    bought and at what time the event occurred.
+    bought and at what time the event occurred. In an aggregated book (_book_tick_size not None) volume bought at the
+    same price level is added to a single entry so the book is bounded by the number of price levels.
     :param _trade_price: (float) price of the trade
     :param _future_trade_price: (float) price of the future trade
     :param _traded_amount: (float) amount traded
     :param _bought: (list) container holding all buying events: [(_trade_price, _traded_amount)]
+    :param _book_tick_size: (float) None for one entry per buying event, otherwise width of aggregated price levels
+     (0 aggregates identical prices only)
     :return: Nothing. Side effects: _bought is changed
     """
     try:
-        logger.info('getBuyCriteria: Evaluating action: buy')
+        logger.debug('getBuyCriteria: Evaluating action: buy')
 
         #if a trade occurred there was a transfer of the instrument between agents
         if _trade_price <= _future_trade_price:
-            #insert sorted
-            bisect.insort(_bought, (_trade_price, _traded_amount))
+            if _book_tick_size is None:
+                #insert sorted
+                bisect.insort(_bought, (_trade_price, _traded_amount))
+
+            else:
+                price_level = _getPriceLevel(_trade_price, _book_tick_size)
+
+                #(price_level,) sorts before any entry at the same price level
+                index = bisect.bisect_left(_bought, (price_level,))
+
+                if index < len(_bought) and _bought[index][0] == price_level:
+                    _bought[index] = (price_level, _bought[index][1] + _traded_amount)
+                else:
+                    _bought.insert(index, (price_level, _traded_amount))
 
     except:
         raise
@@ -50,7 +88,7 @@ def _getNegPotentialVol(_trade_price, _greed, _bought):
     :return: (float) forecasted volume for action sell
     """
     try:
-        logger.info('getNegPotentialVol: Forecasting energy flow.')
+        logger.debug('getNegPotentialVol: Forecasting energy flow.')
 
         #cumulative volume that will potentially be sold as a result of new signal
         forecasted_sold_volume = 0
@@ -65,7 +103,7 @@ def _getNegPotentialVol(_trade_price, _greed, _bought):
             #calculate the costs of the trade
             fee = _trade_price * FEE + bought_price * FEE
             anticipated_target = bought_price + margin + fee
-            logger.debug('getNegPotentialVol: anticipated_target: %s' % anticipated_target)
+            logger.debug('getNegPotentialVol: anticipated_target: %s', anticipated_target)
 
             #estimate profitable amount at current price
             #if we already achieved desired profit, the agent will sell now
@@ -83,6 +121,25 @@ def _getNegPotentialVol(_trade_price, _greed, _bought):
         raise
 
 
+def _getGreedDistribution(_greed_histogram):
+    """
+    Normalizes a greed histogram for population simulations.
+
+    :param _greed_histogram: (list) greed buckets and their weights: [(greed, weight)]
+    :return: (list) [(greed, weight)] with weights summing to 1, ordered by greed
+    """
+    try:
+        total_weight = float(sum(weight for greed, weight in _greed_histogram))
+
+        if total_weight <= 0:
+            raise ValueError('Greed distribution has no weight.')
+
+        return sorted([(greed, weight / total_weight) for greed, weight in _greed_histogram if weight > 0])
+
+    except:
+        raise
+
+
 def _updateSysVol(_vol_cumulative, _bought):
     """
     Updates the system energy.
@@ -93,7 +150,7 @@ def _updateSysVol(_vol_cumulative, _bought):
     :return: Nothing. Side effects: _bought is changed.
     """
     try:
-        logger.info('updateSysVol: Updating system.')
+        logger.debug('updateSysVol: Updating system.')
 
         #starting value, should be !=0 to start the loop!
         leftover = 1
@@ -106,7 +163,7 @@ def _updateSysVol(_vol_cumulative, _bought):
 
                 #get most profitable investment at current price
                 leftover = bought_volume - _vol_cumulative
-                logger.debug('updateSysVol: Most profitable investment: %s' % leftover)
+                logger.debug('updateSysVol: Most profitable investment: %s', leftover)
 
                 #remove investments with zero amount
                 if leftover == 0:
@@ -162,10 +219,10 @@ def _getSellCriteria(_trade_price, _future_trade_price, _traded_amount, _bought,
     :return: Nothing. Side effects: _bought is changed
     """
     try:
-        logger.info('getSellCriteria: Evaluating action: sell')
+        logger.debug('getSellCriteria: Evaluating action: sell')
 
         forecasted_sell_volume = _getNegPotentialVol(_trade_price, _greed, _bought)
-        logger.debug('getSellCriteria: Forecasted_sell_volume: %s' % forecasted_sell_volume)
+        logger.debug('getSellCriteria: Forecasted_sell_volume: %s', forecasted_sell_volume)
 
         number_of_buy_events = len(_bought)
 
@@ -222,6 +279,58 @@ def _getSellCriteria(_trade_price, _future_trade_price, _traded_amount, _bought,
         raise
 
 
+def _getPopulationCriteria(_trade_price, _future_trade_price, _traded_amount, _books, _greed_distribution,
+                           _book_tick_size=None):
+    """
+    Decides when agents of a population with different greed have bought and sold the financial instrument.
+
+    Every greed bucket keeps its own book and sells from it only when its own forecast says so, exactly as a separate
+    simulation with that greed would. The forecast of the population is the blend of the buckets' forecasts weighted
+    by their share of the population.
+    :param _trade_price: (float) price of the trade
+    :param _future_trade_price: (float) price of the future trade
+    :param _traded_amount: (float) amount traded
+    :param _books: (list) one container of buying events per greed bucket: [[(_trade_price, _traded_amount)]]
+    :param _greed_distribution: (list) [(greed, weight)] as returned by _getGreedDistribution
+    :param _book_tick_size: (float) None for one entry per buying event, otherwise width of aggregated price levels
+    :return: (dict) weighted forecast of the population, same keys as returned by _getSellCriteria. Side effects:
+     _books are changed
+    """
+    try:
+        logger.debug('getPopulationCriteria: Evaluating actions of %s greed buckets', len(_books))
+
+        population_forecast_ = {}
+
+        for bought, (greed, weight) in zip(_books, _greed_distribution):
+            _getBuyCriteria1(_trade_price, _future_trade_price, _traded_amount, bought, _book_tick_size)
+            forecast = _getSellCriteria(_trade_price, _future_trade_price, _traded_amount, bought, greed)
+
+            for key, value in forecast.iteritems():
+                population_forecast_[key] = population_forecast_.get(key, 0) + weight * value
+
+        return population_forecast_
+
+    except:
+        raise
+
+
+def _getPopulationBook(_books, _greed_distribution):
+    """
+    Merges the books of all greed buckets into one book of the population.
+
+    :param _books: (list) one container of buying events per greed bucket: [[(_trade_price, _traded_amount)]]
+    :param _greed_distribution: (list) [(greed, weight)] as returned by _getGreedDistribution
+    :return: (list) buying events with amounts weighted by their bucket's share: [(_trade_price, _traded_amount)]
+    """
+    try:
+        return sorted((bought_price, weight * bought_amount)
+                      for bought, (greed, weight) in zip(_books, _greed_distribution)
+                      for bought_price, bought_amount in bought)
+
+    except:
+        raise
+
+
 #check how accurate can you predict agent's actions
 def _getModelAccuracy(_current_response,
                       _trade_price,
@@ -241,7 +350,7 @@ def _getModelAccuracy(_current_response,
     :return: (dict) merged statistics: {'local_statistics': {}, 'global_statistics': {}}
     """
     try:
-        logger.info('getModelAccuracy: Calculating model statistics.')
+        logger.debug('getModelAccuracy: Calculating model statistics.')
 
         global_statistics = stat.getGlobalStatistics(
             _trade_price,
@@ -260,55 +369,94 @@ def _getModelAccuracy(_current_response,
         raise
 
 
-def getAgentReactions(_simulation_data, _greed):
+def iterateAgentReactions(_simulation_data, _greed, _book_tick_size=None, _size_hint=None, _book_snapshots=None):
     """
-    Simulate how agents react to price changes.
-
-    :param _simulation_data: (list) market data: [unix time, trade price, trade amount]
-    :param _greed: (float) simulated agent's greed
-    :return: (list) simulated responses
+    Simulate how agents react to price changes, one response at a time.
+
+    Trades are read one at a time with a single trade lookahead for the future price, so _simulation_data may be any
+    iterable, e.g. a generator reading trades from a file or decompression stream. Only the responses needed for local
+    statistics are kept, so memory does not grow with the number of trades. Passing a greed histogram instead of a
+    single greed simulates a population of agents with one forecast for the whole population, see
+    _getPopulationCriteria.
+    :param _simulation_data: (iterable) market data: [unix time, trade price, trade amount]
+    :param _greed: (float) simulated agent's greed or (list or tuple) greed histogram: [(greed, weight)]
+    :param _book_tick_size: (float) None to keep every buying event, otherwise width of aggregated price levels
+    :param _size_hint: (int) number of trades, used for progress when _simulation_data has no length
+    :param _book_snapshots: (object) lib.snapshots.BookSnapshotWriter receiving the book after every trade, None to
+     skip snapshots
+    :return: (generator) simulated responses
     """
     try:
-        logger.info('getAgentReactions: Simulating agent reaction')
+        logger.info('iterateAgentReactions: Simulating agent reaction')
+
+        #population of agents with different greed
+        greed_distribution = None
+        if isinstance(_greed, (list, tuple)):
+            greed_distribution = _getGreedDistribution(_greed)
 
         #for measuring progress we need to know how much is there still to process
-        size_to_process = len(_simulation_data)
+        if _size_hint is not None:
+            size_to_process = _size_hint
+        elif hasattr(_simulation_data, '__len__'):
+            size_to_process = len(_simulation_data)
+        else:
+            #unknown size
+            size_to_process = 0
 
         #index for measuring relative progress of execution
         progress = 0
+        #no trade is processed yet, drop the index left by a previous simulation
+        prof.setCurrentTrade(0)
 
         #simulate buying: holds events when agent bought the financial instrument
         bought = []
+        #simulate buying of a population: holds one book per greed bucket
+        books = None
+        if greed_distribution is not None:
+            books = [[] for bucket in greed_distribution]
 
-        #simulate response: holds agent responses
-        current_response_ = []
+        #simulate response: holds the latest agent responses, as many as local statistics look at
+        response_window = collections.deque(maxlen=stat.WINDOW_SIZE + 1)
         #simulate response: past price
         previous_price = 0
 
         #track model accuracy: holds metrics for evaluating model accuracy
         track_accuracy = {'true_positive': 0, 'true_negative': 0, 'false_positive': 0, 'false_negative': 0}
 
-        for index in xrange(len(_simulation_data) - 1):
-            current_data_chunk = _simulation_data[index]
+        #the last trade has no future price, so it is only used as lookahead
+        current_data_chunk = None
+
+        for next_data_chunk in _simulation_data:
+            if current_data_chunk is None:
+                current_data_chunk = next_data_chunk
+                continue
+
+            #samples taken from here on belong to this trade
+            prof.setCurrentTrade(progress + 1)
+
             trade_price = current_data_chunk[1]
             trade_amount = current_data_chunk[2]
 
-            next_data_chunk = _simulation_data[index + 1]
             future_trade_price = next_data_chunk[1]
 
-            #simulate agent's buying decisions
-            _getBuyCriteria1(trade_price, future_trade_price, trade_amount, bought)
+            if books is None:
+                #simulate agent's buying decisions
+                _getBuyCriteria1(trade_price, future_trade_price, trade_amount, bought, _book_tick_size)
 
-            #simulate agent's selling decisions
-            forecasted_data = _getSellCriteria(trade_price, future_trade_price, trade_amount,
-                                               bought, _greed)
+                #simulate agent's selling decisions
+                forecasted_data = _getSellCriteria(trade_price, future_trade_price, trade_amount,
+                                                   bought, _greed)
+            else:
+                #simulate buying and selling decisions of every greed bucket
+                forecasted_data = _getPopulationCriteria(trade_price, future_trade_price, trade_amount, books,
+                                                         greed_distribution, _book_tick_size)
 
             #check how relevant is the model
-            if current_response_:
-                previous_price = current_response_[index - 1]['trade_price']
+            if response_window:
+                previous_price = response_window[-1]['trade_price']
 
             accuracy = _getModelAccuracy(
-                current_response_,
+                list(response_window),
                 trade_price,
                 future_trade_price,
                 forecasted_data['forecasted_sell_volume'],
@@ -316,19 +464,319 @@ def getAgentReactions(_simulation_data, _greed):
                 track_accuracy
             )
 
-            current_response_.append(
-                {
-                    'trade_price': trade_price,
-                    'forecast': forecasted_data,
-                    'statistics': accuracy
-                }
-            )
+            response = {
+                'unix_time': current_data_chunk[0],
+                'trade_price': trade_price,
+                'forecast': forecasted_data,
+                'statistics': accuracy
+            }
+
+            #merged data also tells which market the trade came from
+            if len(current_data_chunk) > 3:
+                response['market'] = current_data_chunk[3]
+
+            response_window.append(response)
+
+            if _book_snapshots is not None:
+                if books is None:
+                    _book_snapshots.update(current_data_chunk[0], bought)
+                elif _book_snapshots.isDue(current_data_chunk[0]):
+                    _book_snapshots.update(current_data_chunk[0], _getPopulationBook(books, greed_distribution))
+
+            book_size = len(bought) if books is None else sum(len(book) for book in books)
+
+            current_data_chunk = next_data_chunk
 
             #print progress to console
             progress += 1
             io.displayProgress(progress, size_to_process, accuracy)
+            metrics.updateSimulation(progress, size_to_process, book_size, track_accuracy)
+
+            yield response
+
+        prof.setCurrentTrade(0)
+
+        book_size = len(bought) if books is None else sum(len(book) for book in books)
+
+        #metrics are throttled, publish the final state
+        metrics.updateSimulation(progress, size_to_process, book_size, track_accuracy, True)
+
+        logger.info('iterateAgentReactions: Final book size: %s' % book_size)
+
+    except:
+        raise
+
+
+def getAgentReactions(_simulation_data, _greed, _book_tick_size=None, _size_hint=None, _book_snapshots=None):
+    """
+    Simulate how agents react to price changes.
+
+    :param _simulation_data: (iterable) market data: [unix time, trade price, trade amount]
+    :param _greed: (float) simulated agent's greed or (list or tuple) greed histogram: [(greed, weight)]
+    :param _book_tick_size: (float) None to keep every buying event, otherwise width of aggregated price levels
+    :param _size_hint: (int) number of trades, used for progress when _simulation_data has no length
+    :param _book_snapshots: (object) lib.snapshots.BookSnapshotWriter receiving the book after every trade, None to
+     skip snapshots
+    :return: (list) simulated responses
+    """
+    try:
+        logger.info('getAgentReactions: Simulating agent reaction')
 
-        return current_response_
+        return list(iterateAgentReactions(_simulation_data, _greed, _book_tick_size, _size_hint, _book_snapshots))
 
     except:
-        raise
\ No newline at end of file
+        raise
+
+
+def _simulateSegment(_task):
+    """
+    Simulates one segment of the trade stream in a worker process.
+
+    :param _task: (tuple) (segment data, greed, book tick size, number of warm-up responses to drop)
+    :return: (list) simulated responses without the warm-up
+    """
+    try:
+        segment_data, greed, book_tick_size, warm_up = _task
+
+        #warm-up responses are dropped as they are produced
+        return list(itertools.islice(iterateAgentReactions(segment_data, greed, book_tick_size), warm_up, None))
+
+    except:
+        raise
+
+
+def _stitchSegments(_segment_responses):
+    """
+    Joins segment responses and recalculates global statistics over the whole stream.
+
+    Every segment counts its predictions from its own start so global ratios are rebuilt from the predictions.
+    :param _segment_responses: (list) simulated responses of every segment, in order
+    :return: (list) simulated responses
+    """
+    try:
+        logger.info('stitchSegments: Stitching segments.')
+
+        stitched_responses_ = []
+        track_accuracy = {'true_positive': 0, 'true_negative': 0, 'false_positive': 0, 'false_negative': 0}
+
+        for responses in _segment_responses:
+            for response in responses:
+                global_statistics = response['statistics']['global_statistics']
+
+                if global_statistics['predicted_energy_in'] == 1:
+                    track_accuracy['true_positive'] += 1
+                elif global_statistics['predicted_energy_in'] == -1:
+                    track_accuracy['false_positive'] += 1
+
+                if global_statistics['predicted_energy_out'] == 1:
+                    track_accuracy['true_negative'] += 1
+                elif global_statistics['predicted_energy_out'] == -1:
+                    track_accuracy['false_negative'] += 1
+
+                no_pos = track_accuracy['true_positive'] + track_accuracy['false_positive']
+                no_neg = track_accuracy['true_negative'] + track_accuracy['false_negative']
+
+                global_statistics['global_relative_positives'] = (
+                    float(track_accuracy['true_positive']) / float(no_pos) if no_pos else 0)
+                global_statistics['global_relative_negatives'] = (
+                    float(track_accuracy['true_negative']) / float(no_neg) if no_neg else 0)
+
+                stitched_responses_.append(response)
+
+        logger.info('stitchSegments: Model statistics: %s' % track_accuracy)
+
+        return stitched_responses_
+
+    except:
+        raise
+
+
+def _getResponseDivergence(_reference_responses, _approximate_responses):
+    """
+    Compares approximate responses with a reference run of the same trades.
+
+    :param _reference_responses: (list) responses of the exact run
+    :param _approximate_responses: (list) responses of the approximate run for the same trades
+    :return: (dict) share of differing predictions and the mean absolute difference of forecasted volume and book size
+    """
+    try:
+        logger.info('getResponseDivergence: Comparing approximate and reference run.')
+
+        size = min(len(_reference_responses), len(_approximate_responses))
+        differing_predictions = 0
+        volume_difference = 0.0
+        book_size_difference = 0
+
+        for reference, approximate in zip(_reference_responses[:size], _approximate_responses[:size]):
+            reference_statistics = reference['statistics']['global_statistics']
+            approximate_statistics = approximate['statistics']['global_statistics']
+
+            if (reference_statistics['predicted_energy_in'] != approximate_statistics['predicted_energy_in'] or
+                    reference_statistics['predicted_energy_out'] != approximate_statistics['predicted_energy_out']):
+                differing_predictions += 1
+
+            volume_difference += abs(reference['forecast']['forecasted_sell_volume'] -
+                                     approximate['forecast']['forecasted_sell_volume'])
+            book_size_difference += abs(reference['forecast']['number_of_buy_events'] -
+                                        approximate['forecast']['number_of_buy_events'])
+
+        return {
+            'compared_responses': size,
+            'differing_predictions': float(differing_predictions) / size if size else 0,
+            'mean_volume_difference': volume_difference / size if size else 0,
+            'mean_book_size_difference': float(book_size_difference) / size if size else 0,
+        }
+
+    except:
+        raise
+
+
+def getSegmentedAgentReactions(_simulation_data, _greed, _number_of_segments, _warm_up, _validation_size=0,
+                               _book_tick_size=None):
+    """
+    Simulate how agents react to price changes using one process per time segment.
+
+    The trade stream is split into _number_of_segments consecutive segments. Every segment first replays _warm_up
+    preceding trades to rebuild the agent book and drops their responses, so results are approximate at segment
+    boundaries. When _validation_size is set the first segment is simulated _validation_size trades past its end and
+    the divergence of the second segment from this serial reference is reported.
+    :param _simulation_data: (list) market data: [unix time, trade price, trade amount]
+    :param _greed: (float) simulated agent's greed or (list or tuple) greed histogram: [(greed, weight)]
+    :param _number_of_segments: (int) number of segments simulated in parallel
+    :param _warm_up: (int) number of trades replayed before every segment
+    :param _validation_size: (int) number of responses compared with a serial run, 0 to skip validation
+    :param _book_tick_size: (float) None to keep every buying event, otherwise width of aggregated price levels
+    :return: (list) simulated responses
+    """
+    try:
+        logger.info('getSegmentedAgentReactions: Simulating agent reaction in %s segments' % _number_of_segments)
+
+        #every trade but the last gets a response
+        size_to_process = len(_simulation_data) - 1
+        bounds = [size_to_process * i // _number_of_segments for i in xrange(_number_of_segments + 1)]
+
+        #serial reference over the first segment boundary: the first segment, which is an exact serial run, is
+        # extended past its end
+        validate = _validation_size and _number_of_segments > 1
+        segment_ends = bounds[1:]
+        if validate:
+            segment_ends[0] = min(bounds[1] + _validation_size, size_to_process)
+
+        #segment tasks: hold (data incl. warm-up and the next trade for its future price, greed, warm-up size)
+        tasks = []
+        for start, end in zip(bounds[:-1], segment_ends):
+            warm_up_start = max(0, start - _warm_up)
+            tasks.append((_simulation_data[warm_up_start:end + 1], _greed, _book_tick_size, start - warm_up_start))
+
+        pool = multiprocessing.Pool(min(len(tasks), multiprocessing.cpu_count()))
+        try:
+            results = pool.map(_simulateSegment, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+        if validate:
+            serial_responses = results[0][bounds[1]:]
+            results[0] = results[0][:bounds[1]]
+            divergence = _getResponseDivergence(serial_responses, results[1])
+
+            logger.info('getSegmentedAgentReactions: Divergence from serial run: %s' % divergence)
+            print ('Divergence from serial run over %s responses: differing predictions = %.5f, '
+                   'mean volume difference = %.5f, mean book size difference = %.5f'
+                   % (divergence['compared_responses'], divergence['differing_predictions'],
+                      divergence['mean_volume_difference'], divergence['mean_book_size_difference']))
+
+        return _stitchSegments(results)
+
+    except:
+        raise
+
+
+def getBookAggregationDeviation(_simulation_data, _greed, _book_tick_size, _validation_size):
+    """
+    Reports how far an aggregated book deviates from the exact book.
+
+    Both books are simulated on the first _validation_size trades.
+    :param _simulation_data: (list) market data: [unix time, trade price, trade amount]
+    :param _greed: (float) simulated agent's greed or (list or tuple) greed histogram: [(greed, weight)]
+    :param _book_tick_size: (float) width of aggregated price levels, 0 aggregates identical prices only
+    :param _validation_size: (int) number of trades to compare
+    :return: (dict) divergence of the aggregated book and the largest book size of both modes
+    """
+    try:
+        logger.info('getBookAggregationDeviation: Comparing aggregated and exact book.')
+
+        validation_data = _simulation_data[:_validation_size + 1]
+        exact_responses = getAgentReactions(validation_data, _greed)
+        aggregated_responses = getAgentReactions(validation_data, _greed, _book_tick_size)
+
+        deviation_ = _getResponseDivergence(exact_responses, aggregated_responses)
+        deviation_['exact_book_size'] = max([r['forecast']['number_of_buy_events'] for r in exact_responses] or [0])
+        deviation_['aggregated_book_size'] = max([r['forecast']['number_of_buy_events']
+                                                  for r in aggregated_responses] or [0])
+
+        logger.info('getBookAggregationDeviation: Deviation: %s' % deviation_)
+        print ('Aggregated book (tick size %s) over %s trades: book size %s (exact %s), differing predictions = %.5f, '
+               'mean volume difference = %.5f'
+               % (_book_tick_size, deviation_['compared_responses'], deviation_['aggregated_book_size'],
+                  deviation_['exact_book_size'], deviation_['differing_predictions'],
+                  deviation_['mean_volume_difference']))
+
+        return deviation_
+
+    except:
+        raise
+
+
+def getPopulationBlendDeviation(_simulation_data, _greed_histogram, _validation_size):
+    """
+    Reports how far a population simulation deviates from the weighted blend of separate single greed simulations.
+
+    The population is simulated on the first _validation_size trades, as is every greed bucket on its own. Both should
+    give the same forecasts.
+    :param _simulation_data: (list) market data: [unix time, trade price, trade amount]
+    :param _greed_histogram: (list) greed buckets and their weights: [(greed, weight)]
+    :param _validation_size: (int) number of trades to compare
+    :return: (dict) number of compared responses, share of responses with a differing forecast and the largest
+     difference of forecasted volume
+    """
+    try:
+        logger.info('getPopulationBlendDeviation: Comparing population and blended single greed runs.')
+
+        validation_data = _simulation_data[:_validation_size + 1]
+        population_responses = getAgentReactions(validation_data, _greed_histogram)
+
+        #blend: holds the weighted sum of forecasts of the separate runs, summed in the population's bucket order
+        blended_forecasts = [{} for response in population_responses]
+        for greed, weight in _getGreedDistribution(_greed_histogram):
+            for blended, response in zip(blended_forecasts, getAgentReactions(validation_data, greed)):
+                for key, value in response['forecast'].iteritems():
+                    blended[key] = blended.get(key, 0) + weight * value
+
+        differing_forecasts = 0
+        maximum_volume_difference = 0.0
+
+        for response, blended in zip(population_responses, blended_forecasts):
+            if response['forecast'] != blended:
+                differing_forecasts += 1
+
+            maximum_volume_difference = max(maximum_volume_difference,
+                                            abs(response['forecast']['forecasted_sell_volume'] -
+                                                blended['forecasted_sell_volume']))
+
+        size = len(population_responses)
+        deviation_ = {
+            'compared_responses': size,
+            'differing_forecasts': float(differing_forecasts) / size if size else 0,
+            'maximum_volume_difference': maximum_volume_difference,
+        }
+
+        logger.info('getPopulationBlendDeviation: Deviation: %s' % deviation_)
+        print ('Population over %s trades compared with blended single greed runs: differing forecasts = %.5f, '
+               'maximum volume difference = %.5f'
+               % (size, deviation_['differing_forecasts'], deviation_['maximum_volume_difference']))
+
+        return deviation_
+
+    except:
+        raise
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+"""
+Functions to analyse prices across markets.
+
+The merged database interleaves all markets in USD terms. Streaming it once while keeping the last price of every
+market gives the cross-market spread at every timestamp and shows which markets move first.
+"""
+
+import array
+import logging
+
+logger = logging.getLogger(__name__)
+#markets without a trade for this many seconds are left out of the spread
+SPREAD_STALE_AFTER = 3600
+#a move of one market is related to moves of other markets at most this many seconds earlier
+LEAD_LAG_WINDOW = 60
+
+
+class _MarketState(object):
+    """
+    Array-backed last price and last move of every market seen so far.
+    """
+
+    def __init__(self):
+        self.index = {}
+        self.names = []
+        self.last_price = array.array('d')
+        self.last_time = array.array('d')
+        self.last_move_sign = array.array('b')
+        self.last_move_time = array.array('d')
+        #pair statistics, [leader][follower]: holds number of related moves, agreeing moves and summed lag
+        self.events = []
+        self.agreements = []
+        self.lag_sum = []
+
+    def getIndex(self, _market):
+        index = self.index.get(_market)
+
+        if index is None:
+            index = self.index[_market] = len(self.names)
+            self.names.append(_market)
+            self.last_price.append(0.0)
+            self.last_time.append(0.0)
+            self.last_move_sign.append(0)
+            self.last_move_time.append(0.0)
+
+            #grow pair statistics by one row and one column
+            for row in (self.events, self.agreements):
+                for leader_row in row:
+                    leader_row.append(0)
+                row.append(array.array('l', [0] * (index + 1)))
+            for leader_row in self.lag_sum:
+                leader_row.append(0.0)
+            self.lag_sum.append(array.array('d', [0.0] * (index + 1)))
+
+        return index
+
+
+def _updateLeadLag(_state, _market_index, _unix_time, _move_sign):
+    """
+    Relates a price move to the latest moves of all other markets.
+
+    :param _state: (object) market state
+    :param _market_index: (int) index of the market that moved
+    :param _unix_time: (float) time of the move
+    :param _move_sign: (int) 1 if the price went up, -1 if it went down
+    :return: Nothing. Side effects: _state is changed.
+    """
+    try:
+        last_move_sign = _state.last_move_sign
+        last_move_time = _state.last_move_time
+
+        for leader in xrange(len(_state.names)):
+            if leader == _market_index or not last_move_sign[leader]:
+                continue
+
+            lag = _unix_time - last_move_time[leader]
+
+            if lag <= LEAD_LAG_WINDOW:
+                _state.events[leader][_market_index] += 1
+
+                #the follower moved in the same direction as the leader did before
+                if last_move_sign[leader] == _move_sign:
+                    _state.agreements[leader][_market_index] += 1
+                    _state.lag_sum[leader][_market_index] += lag
+
+        last_move_sign[_market_index] = _move_sign
+        last_move_time[_market_index] = _unix_time
+
+    except:
+        raise
+
+
+def _getSpread(_state, _unix_time):
+    """
+    Finds the best bid and offer proxies among markets that traded recently.
+
+    The highest last price is where one could sell (bid proxy), the lowest where one could buy (offer proxy).
+    :param _state: (object) market state
+    :param _unix_time: (float) current time
+    :return: (list) [unix time, best bid, best bid market, best offer, best offer market, spread, number of markets]
+    """
+    try:
+        best_bid = best_offer = None
+        number_of_markets = 0
+
+        for index in xrange(len(_state.names)):
+            if _unix_time - _state.last_time[index] > SPREAD_STALE_AFTER:
+                continue
+
+            number_of_markets += 1
+            price = _state.last_price[index]
+
+            if best_bid is None or price > _state.last_price[best_bid]:
+                best_bid = index
+            if best_offer is None or price < _state.last_price[best_offer]:
+                best_offer = index
+
+        bid_price = _state.last_price[best_bid]
+        offer_price = _state.last_price[best_offer]
+
+        return [_unix_time, bid_price, _state.names[best_bid], offer_price, _state.names[best_offer],
+                bid_price - offer_price, number_of_markets]
+
+    except:
+        raise
+
+
+def getCrossMarketStatistics(_merged_data):
+    """
+    Calculates cross-market spreads and lead/lag statistics in one pass.
+
+    :param _merged_data: (iterable) ordered market data: [unix time, trade price, trade amount, market name]
+    :return: (dict) {'spreads': [[unix time, best bid, best bid market, best offer, best offer market, spread,
+     number of markets]], 'lead_lag': [{'leader': string, 'follower': string, 'events': int, 'agreement': float,
+     'mean_lag': float}]}
+    """
+    try:
+        logger.info('getCrossMarketStatistics: Calculating cross-market statistics.')
+
+        state = _MarketState()
+
+        #spreads: holds one entry per timestamp
+        spreads = []
+        current_time = None
+
+        for entry in _merged_data:
+            unix_time, price, market = entry[0], entry[1], entry[3]
+
+            #emit the spread once all trades of a timestamp are in
+            if current_time is not None and unix_time != current_time:
+                spreads.append(_getSpread(state, current_time))
+            current_time = unix_time
+
+            index = state.getIndex(market)
+            last_price = state.last_price[index]
+
+            if last_price and price != last_price:
+                _updateLeadLag(state, index, unix_time, 1 if price > last_price else -1)
+
+            state.last_price[index] = price
+            state.last_time[index] = unix_time
+
+        if current_time is not None:
+            spreads.append(_getSpread(state, current_time))
+
+        lead_lag = []
+        for leader, leader_name in enumerate(state.names):
+            for follower, follower_name in enumerate(state.names):
+                events = state.events[leader][follower]
+
+                if leader == follower or not events:
+                    continue
+
+                agreements = state.agreements[leader][follower]
+                lead_lag.append({
+                    'leader': leader_name,
+                    'follower': follower_name,
+                    'events': events,
+                    'agreement': float(agreements) / events,
+                    'mean_lag': state.lag_sum[leader][follower] / agreements if agreements else 0,
+                })
+
+        logger.info('getCrossMarketStatistics: %s timestamps, %s markets.' % (len(spreads), len(state.names)))
+
+        return {'spreads': spreads, 'lead_lag': lead_lag}
+
+    except:
+        raise
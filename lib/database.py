@@ -4,17 +4,26 @@
 Functions to construct and normalize database
 """
 
+import gzip
+import hashlib
 import json
 import heapq
 import logging
+import multiprocessing
+import os
 import time
 import lib.io as io
+import lib.metrics as metrics
 import lib.network as net
 
 logger = logging.getLogger(__name__)
 URL_TRADES = 'http://bitcoincharts.com/t/trades.csv?symbol='
 URL_EXCHANGES = 'http://bitcoincharts.com/t/markets.json'
 PAUSE_BETWEEN_RECONNECTS = 3
+DUMP_EXTENSION = '.csv.gz'
+#number of trades written to the market store at once when ingesting dumps
+INGEST_BATCH_SIZE = 10000
+HASH_CHUNK_SIZE = 1048576
 
 
 ################################
@@ -115,11 +124,13 @@ def createDatabase(_database_folder):
 
             #get data
             print "Retrieving data for market: ", market
+            metrics.setMarketProgress('download', market, False)
             trades = _getTrades(market)
 
             #save the data
             file_path = _database_folder + '/' + market + ".json"
             io.serializeData(file_path, trades)
+            metrics.setMarketProgress('download', market, True)
 
             #don't get banned by the server
             time.sleep(PAUSE_BETWEEN_RECONNECTS)
@@ -128,6 +139,117 @@ def createDatabase(_database_folder):
         raise
 
 
+def iterateDumpTrades(_dump_path):
+    """
+    Reads trades from a compressed bitcoincharts dump one at a time.
+
+    The dump is decompressed and parsed line by line, so memory use does not depend on the size of the dump. The
+    trades can be fed directly to lib.agents.iterateAgentReactions. Example data lines to parse:
+    "1340234323,5.407670000000,0.990600000000"
+    :param _dump_path: (string) path of the <market>.csv.gz dump
+    :return: (generator) trades e.g. [1340234323.0, 5.40767, 0.9906]
+    """
+    try:
+        logger.info('iterateDumpTrades: Reading: %s' % _dump_path)
+
+        dump = gzip.open(_dump_path, 'rb')
+        try:
+            for line in dump:
+                line = line.strip()
+                if not line:
+                    continue
+
+                #parse fields to float since we're not interested in high precision
+                unix_time, price, amount = line.split(',')
+                yield [float(unix_time), float(price), float(amount)]
+
+        finally:
+            dump.close()
+
+    except:
+        raise
+
+
+def _ingestDump(_task):
+    """
+    Converts a compressed bitcoincharts dump of one market into the market store.
+
+    Trades are written in batches of INGEST_BATCH_SIZE, so memory use does not depend on the size of the dump.
+    :param _task: (tuple) (path of the dump, path of the market file)
+    :return: (tuple) (market file path, number of trades). Side effects: Writes data to disk.
+    """
+    try:
+        dump_path, file_path = _task
+        logger.info('ingestDump: Ingesting: %s' % dump_path)
+
+        number_of_trades = 0
+        batch = []
+
+        #the market store is a JSON list of [unix_time, price, amount], written piece by piece
+        with open(file_path, 'w') as f_out:
+            f_out.write('[')
+
+            for trade in iterateDumpTrades(dump_path):
+                batch.append('[%r, %r, %r]' % tuple(trade))
+
+                if len(batch) == INGEST_BATCH_SIZE:
+                    f_out.write((', ' if number_of_trades else '') + ', '.join(batch))
+                    number_of_trades += len(batch)
+                    batch = []
+
+            if batch:
+                f_out.write((', ' if number_of_trades else '') + ', '.join(batch))
+                number_of_trades += len(batch)
+
+            f_out.write(']')
+
+        return file_path, number_of_trades
+
+    except:
+        raise
+
+
+def createDatabaseFromDumps(_dumps_folder, _database_folder):
+    """
+    Builds the database from local bitcoincharts dumps.
+
+    bitcoincharts.com publishes the full history of every market as <market>.csv.gz. Unlike the trades API these
+    dumps are at full resolution and are not rate limited. Markets are ingested in parallel, one process per market.
+    :param _dumps_folder: (string) folder containing *.csv.gz dumps
+    :param _database_folder: (string) name of the folder where market data is to be saved
+    :return: Nothing. Side effects: Writes data to disk.
+    """
+    try:
+        logger.info('createDatabaseFromDumps: Building database from: %s' % _dumps_folder)
+
+        #ingest tasks: holds (dump path, market file path)
+        tasks = []
+        for dump_name in sorted(os.listdir(_dumps_folder)):
+            if dump_name.endswith(DUMP_EXTENSION):
+                market = dump_name[:-len(DUMP_EXTENSION)]
+                tasks.append((_dumps_folder + '/' + dump_name, _database_folder + '/' + market + '.json'))
+                metrics.setMarketProgress('ingest', market, False)
+
+        if not tasks:
+            logger.warning('createDatabaseFromDumps: No %s files found in: %s' % (DUMP_EXTENSION, _dumps_folder))
+            return
+
+        pool = multiprocessing.Pool(min(len(tasks), multiprocessing.cpu_count()))
+        try:
+            for file_path, number_of_trades in pool.imap_unordered(_ingestDump, tasks):
+                market = io.getDatabaseCurrency(file_path)['market_name']
+                metrics.setMarketProgress('ingest', market, True)
+
+                logger.debug('createDatabaseFromDumps: Ingested %s trades of: %s' % (number_of_trades, market))
+                print 'Ingested %s trades of market: %s' % (number_of_trades, market)
+        finally:
+            pool.close()
+            pool.join()
+
+    except:
+        raise
+
+
 #################################
 #database normalization functions
 #################################
@@ -176,7 +298,7 @@ def _prepareDataForSorting(_hq, _normalized_data, _market_name):
         logger.info('prepareDataForSorting: Pushing data to heap queue.')
 
         for entry in _normalized_data:
-            logger.debug('prepareDataForSorting: Processing: %s' % entry)
+            logger.debug('prepareDataForSorting: Processing: %s', entry)
 
             #since all in one huge list, append index so we know where it came from
             entry.append(_market_name)
@@ -214,6 +336,30 @@ def _getOrderedData(_hq):
         raise
 
 
+def _getExchangeRate(_currency, _downloaded_rates):
+    """
+    Retrieves exchange rate of a currency relative to USD.
+
+    :param _currency: (string) currency of the market
+    :param _downloaded_rates: (map) rates that we already downloaded
+    :return: (float) exchange rate, 0 if not available. Side effect: _downloaded_rates is being changed.
+    """
+    try:
+        #don't send duplicated requests
+        if _currency in _downloaded_rates:
+            exchange_rate_ = _downloaded_rates[_currency]
+        else:
+            #keep track of reconnections: holds an index of how many times we have already sent the same request
+            track_reconnections = {'times_reconnected': 0}
+            exchange_rate_ = net.downloadExchangeRates(_currency, track_reconnections) if _currency != 'USD' else 1.0
+            _downloaded_rates[_currency] = exchange_rate_
+
+        return exchange_rate_
+
+    except:
+        raise
+
+
 def getNormalizedOrderedData(_market_file_names):
     """
     Normalize prices from foreign markets to USD.
@@ -237,25 +383,242 @@ def getNormalizedOrderedData(_market_file_names):
 
             parsed_file_name = io.getDatabaseCurrency(file_name)
             currency = parsed_file_name['currency']
+            metrics.setMarketProgress('normalize', parsed_file_name['market_name'], False)
 
             #get exchange rate for currency
-            #don't send duplicated requests
-            if currency in downloaded_rates:
-                exchange_rate = downloaded_rates[currency]
-            else:
-                #keep track of reconnections: holds an index of how many times we have already sent the same request
-                track_reconnections = {'times_reconnected': 0}
-                exchange_rate = net.downloadExchangeRates(currency, track_reconnections) if currency != 'USD' else 1.0
-                downloaded_rates[currency] = exchange_rate
+            exchange_rate = _getExchangeRate(currency, downloaded_rates)
 
             #include and process only data with valid exchange rate
             if exchange_rate:
                 normalized_data = _normalize(file_name, exchange_rate)
                 _prepareDataForSorting(hq, normalized_data, parsed_file_name['market_name'])
 
+            metrics.setMarketProgress('normalize', parsed_file_name['market_name'], True)
+
         ordered_data_ = _getOrderedData(hq)
 
         return ordered_data_
 
     except:
-        raise
\ No newline at end of file
+        raise
+
+
+def _getFileHash(_file_name):
+    """
+    Hashes file content.
+
+    :param _file_name: (string) path of the file
+    :return: (string) SHA-1 hex digest
+    """
+    try:
+        sha1 = hashlib.sha1()
+
+        with open(_file_name, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), ''):
+                sha1.update(chunk)
+
+        return sha1.hexdigest()
+
+    except:
+        raise
+
+
+def _isArtifact(_file_name, _artifacts_folder):
+    """
+    :param _file_name: (string) path of an artifact recorded in a build manifest, None for none
+    :param _artifacts_folder: (string) folder holding normalized data of every market
+    :return: (bool) True if the file exists in _artifacts_folder
+    """
+    try:
+        return bool(_file_name and os.path.exists(_file_name) and
+                    os.path.abspath(os.path.dirname(_file_name)) == os.path.abspath(_artifacts_folder))
+
+    except:
+        raise
+
+
+def _isReusable(_previous_entry, _file_hash, _exchange_rate, _artifacts_folder):
+    """
+    Checks whether the normalized data of a market from the previous build can be reused.
+
+    :param _previous_entry: (dict) manifest entry of the market from the previous build, None if there is none
+    :param _file_hash: (string) current hash of the market file
+    :param _exchange_rate: (float) current exchange rate of the market's currency
+    :param _artifacts_folder: (string) folder holding normalized data of every market
+    :return: (bool) True if neither the file nor the rate changed and the normalized data is still on disk
+    """
+    try:
+        if not _previous_entry or _previous_entry['hash'] != _file_hash or _previous_entry['rate'] != _exchange_rate:
+            return False
+
+        #markets without data have no artifact
+        return not _previous_entry['entries'] or _isArtifact(_previous_entry.get('artifact'), _artifacts_folder)
+
+    except:
+        raise
+
+
+def getIncrementallyNormalizedOrderedData(_market_file_names, _merged_file_name, _manifest_file_name,
+                                          _artifacts_folder):
+    """
+    Normalize and order market data, reprocessing only markets that changed since the previous build.
+
+    Every market's normalized and ordered data is kept as an artifact in _artifacts_folder; the build manifest records
+    every market's file hash, the exchange rate used and its artifact. Only markets whose file or rate changed are
+    normalized again. If no market changed, appeared or disappeared the merged output is left as it is, otherwise it
+    is merged again from the artifacts. The merged output is the same as the one of getNormalizedOrderedData.
+    :param _market_file_names: (list) of absolute paths of saved market data
+    :param _merged_file_name: (string) path of the merged output
+    :param _manifest_file_name: (string) path of the build manifest
+    :param _artifacts_folder: (string) folder holding normalized data of every market
+    :return: Nothing. Side effects: saves the artifacts, the merged data and the manifest to disk.
+    """
+    try:
+        logger.info('getIncrementallyNormalizedOrderedData: Normalizing and ordering changed market data.')
+
+        #previous build: holds {market: {'file': string, 'hash': string, 'rate': float, 'artifact': string,
+        # 'entries': int}}
+        manifest = {}
+
+        if os.path.exists(_manifest_file_name) and os.path.exists(_merged_file_name):
+            with open(_manifest_file_name, 'r') as f:
+                manifest = json.load(f)
+
+        io.createFolder(_artifacts_folder)
+
+        #build outputs live in the database folder too
+        build_files = [os.path.abspath(path) for path in (_merged_file_name, _manifest_file_name, _artifacts_folder)]
+
+        new_manifest = {}
+        #changed markets: holds {market: normalized and ordered data}
+        changed_data = {}
+        downloaded_rates = {}
+
+        for file_name in _market_file_names:
+            if os.path.abspath(file_name) in build_files:
+                continue
+
+            parsed_file_name = io.getDatabaseCurrency(file_name)
+            market = parsed_file_name['market_name']
+            metrics.setMarketProgress('normalize', market, False)
+
+            file_hash = _getFileHash(file_name)
+            exchange_rate = _getExchangeRate(parsed_file_name['currency'], downloaded_rates)
+
+            previous_entry = manifest.get(market)
+            if _isReusable(previous_entry, file_hash, exchange_rate, _artifacts_folder):
+                new_manifest[market] = previous_entry
+
+            else:
+                logger.debug('getIncrementallyNormalizedOrderedData: Processing: %s' % file_name)
+                print 'Processing: ', file_name
+
+                market_data = []
+                artifact = None
+
+                #include and process only data with valid exchange rate
+                if exchange_rate:
+                    for entry in _normalize(file_name, exchange_rate):
+                        #our entry has now the form [unix time, price, amount, market name]
+                        entry.append(market)
+                        market_data.append(entry)
+
+                if market_data:
+                    market_data.sort()
+                    artifact = _artifacts_folder + '/' + market + '.json'
+
+                    #json.dump encodes in Python, json.dumps in C
+                    with open(artifact, 'w') as f:
+                        f.write(json.dumps(market_data))
+
+                changed_data[market] = market_data
+                new_manifest[market] = {'file': file_name, 'hash': file_hash, 'rate': exchange_rate,
+                                        'artifact': artifact, 'entries': len(market_data)}
+
+            metrics.setMarketProgress('normalize', market, True)
+
+        logger.info('getIncrementallyNormalizedOrderedData: Reusing %s of %s markets.' %
+                    (len(new_manifest) - len(changed_data), len(new_manifest)))
+
+        #nothing changed, appeared or disappeared: the merged output is up to date
+        if not changed_data and set(new_manifest) == set(manifest):
+            print 'Merged data is up to date.'
+            return
+
+        #splice: every market's data is an ordered run, sorting merges the runs without comparing within them
+        merged_data = []
+        for market, entry in new_manifest.iteritems():
+            if market in changed_data:
+                merged_data.extend(changed_data[market])
+            elif entry['entries']:
+                with open(entry['artifact'], 'r') as f:
+                    merged_data.extend(json.load(f))
+
+        merged_data.sort()
+
+        if merged_data:
+            logger.info('getIncrementallyNormalizedOrderedData: Saving data to: %s' % _merged_file_name)
+
+            with open(_merged_file_name, 'w') as f:
+                f.write(json.dumps(merged_data))
+
+        with open(_manifest_file_name, 'w') as f:
+            json.dump(new_manifest, f)
+
+        #artifacts of markets that disappeared
+        for market, entry in manifest.iteritems():
+            if market not in new_manifest and _isArtifact(entry.get('artifact'), _artifacts_folder):
+                os.remove(entry['artifact'])
+
+    except:
+        raise
+
+
+###############################
+#database compression functions
+###############################
+def getCoalescedData(_ordered_data):
+    """
+    Merges runs of equivalent trades into single events.
+
+    Large orders are often filled in many pieces which show up as consecutive trades on the same market, at the same
+    price and within the same second. Such a run carries no more price information than a single trade so we merge it
+    into one event with the summed amount. Fewer events mean fewer simulation steps.
+    :param _ordered_data: (list) ordered market data: [unix time, trade price, trade amount, market name]
+    :return: (list) coalesced data in the same format as _ordered_data
+    """
+    try:
+        logger.info('getCoalescedData: Coalescing market data.')
+
+        #coalesce data: holds merged trade events
+        coalesced_data_ = []
+
+        for entry in _ordered_data:
+            logger.debug('getCoalescedData: Processing: %s', entry)
+
+            if coalesced_data_:
+                last_entry = coalesced_data_[-1]
+
+                #same market, same price, same second: part of the same fill
+                if (int(last_entry[0]) == int(entry[0]) and last_entry[1] == entry[1] and
+                        last_entry[3:] == list(entry[3:])):
+                    last_entry[2] += entry[2]
+                    continue
+
+            #copy so the input data is not changed when amounts are summed
+            coalesced_data_.append(list(entry))
+
+        #report how much we gained
+        original_size = len(_ordered_data)
+        coalesced_size = len(coalesced_data_)
+        compression_ratio = float(original_size) / float(coalesced_size) if coalesced_size else 1.0
+
+        logger.info('getCoalescedData: Coalesced %s events into %s, compression ratio: %.3f' %
+                    (original_size, coalesced_size, compression_ratio))
+        print 'Coalesced %s events into %s, compression ratio: %.3f' % (original_size, coalesced_size,
+                                                                         compression_ratio)
+
+        return coalesced_data_
+
+    except:
+        raise
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+
+"""
+Functions to evaluate saved simulation results.
+
+Prediction outcomes are loaded once into flat arrays and turned into cumulative confusion counts. Global, rolling and
+grouped metrics are then computed from these counts in single passes, so new metrics can be evaluated on old
+simulations without running them again. To add a metric register a function of the confusion counts in METRICS.
+"""
+
+import array
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+GLOBAL_METRICS = ['accuracy', 'precision', 'recall', 'f1', 'relative_positives', 'relative_negatives']
+ROLLING_METRICS = ['accuracy']
+ROLLING_WINDOWS = [100, 1000, 10000]
+GROUP_BY = ['market', 'hour']
+#confusion counts derived from predictions
+OUTCOMES = ['true_positive', 'false_positive', 'true_negative', 'false_negative']
+
+
+def _divide(_numerator, _denominator):
+    return float(_numerator) / float(_denominator) if _denominator else 0
+
+
+def _getAccuracy(_confusion):
+    correct = _confusion['true_positive'] + _confusion['true_negative']
+
+    return _divide(correct, correct + _confusion['false_positive'] + _confusion['false_negative'])
+
+
+def _getPrecision(_confusion):
+    return _divide(_confusion['true_positive'], _confusion['true_positive'] + _confusion['false_positive'])
+
+
+def _getRecall(_confusion):
+    return _divide(_confusion['true_positive'], _confusion['true_positive'] + _confusion['false_negative'])
+
+
+def _getF1(_confusion):
+    precision = _getPrecision(_confusion)
+    recall = _getRecall(_confusion)
+
+    return _divide(2 * precision * recall, precision + recall)
+
+
+def _getRelativeNegatives(_confusion):
+    return _divide(_confusion['true_negative'], _confusion['true_negative'] + _confusion['false_negative'])
+
+
+#metric name: function of confusion counts {'true_positive': int, ...}
+METRICS = {
+    'accuracy': _getAccuracy,
+    'precision': _getPrecision,
+    'recall': _getRecall,
+    'f1': _getF1,
+    #same ratios as global_relative_positives/negatives in lib.statistics
+    'relative_positives': _getPrecision,
+    'relative_negatives': _getRelativeNegatives,
+}
+
+
+def _getHourKey(_unix_time):
+    return time.gmtime(_unix_time).tm_hour
+
+
+def getPredictionOutcomes(_simulated_responses):
+    """
+    Collects prediction outcomes of simulated responses into arrays.
+
+    :param _simulated_responses: (iterable) responses returned by lib.agents.getAgentReactions
+    :return: (dict) {'unix_time': array, 'energy_in': array, 'energy_out': array, 'market': list}
+    """
+    try:
+        logger.info('getPredictionOutcomes: Collecting prediction outcomes.')
+
+        outcomes_ = {
+            'unix_time': array.array('d'),
+            'energy_in': array.array('b'),
+            'energy_out': array.array('b'),
+            'market': [],
+        }
+
+        for index, response in enumerate(_simulated_responses):
+            global_statistics = response['statistics']['global_statistics']
+
+            #results of older simulations have no time and market
+            outcomes_['unix_time'].append(response.get('unix_time', index))
+            outcomes_['market'].append(response.get('market'))
+            outcomes_['energy_in'].append(global_statistics['predicted_energy_in'])
+            outcomes_['energy_out'].append(global_statistics['predicted_energy_out'])
+
+        return outcomes_
+
+    except:
+        raise
+
+
+def loadPredictionOutcomes(_file_path):
+    """
+    Loads prediction outcomes of a simulation into arrays.
+
+    :param _file_path: (string) path of *_simulated_response_with_parameter_* file
+    :return: (dict) {'unix_time': array, 'energy_in': array, 'energy_out': array, 'market': list}
+    """
+    try:
+        logger.info('loadPredictionOutcomes: Loading: %s' % _file_path)
+
+        with open(_file_path, 'r') as f:
+            responses = json.load(f)
+
+        return getPredictionOutcomes(responses)
+
+    except:
+        raise
+
+
+def _getCumulativeConfusion(_outcomes):
+    """
+    Counts prediction outcomes cumulatively.
+
+    Counts of any range [start, end) are then cumulative[end] - cumulative[start].
+    :param _outcomes: (dict) prediction outcomes returned by loadPredictionOutcomes
+    :return: (dict) {outcome: array of size len(outcomes) + 1}
+    """
+    try:
+        logger.info('getCumulativeConfusion: Counting prediction outcomes.')
+
+        cumulative_ = {}
+        for outcome in OUTCOMES:
+            cumulative_[outcome] = array.array('l', [0])
+
+        counts = dict.fromkeys(OUTCOMES, 0)
+
+        for energy_in, energy_out in zip(_outcomes['energy_in'], _outcomes['energy_out']):
+            if energy_in == 1:
+                counts['true_positive'] += 1
+            elif energy_in == -1:
+                counts['false_positive'] += 1
+
+            if energy_out == 1:
+                counts['true_negative'] += 1
+            elif energy_out == -1:
+                counts['false_negative'] += 1
+
+            for outcome in OUTCOMES:
+                cumulative_[outcome].append(counts[outcome])
+
+        return cumulative_
+
+    except:
+        raise
+
+
+def _getRollingMetrics(_cumulative, _metrics, _windows):
+    """
+    Calculates metrics over sliding windows.
+
+    :param _cumulative: (dict) cumulative confusion counts
+    :param _metrics: (list) metric names
+    :param _windows: (list) window sizes
+    :return: (dict) {window: {metric: array}}, value i covers the window ending with prediction i
+    """
+    try:
+        logger.info('getRollingMetrics: Calculating rolling metrics.')
+
+        size = len(_cumulative['true_positive']) - 1
+        rolling_ = {}
+
+        for window in _windows:
+            values = dict((metric, array.array('f')) for metric in _metrics)
+
+            for end in xrange(1, size + 1):
+                start = max(0, end - window)
+                confusion = dict((outcome, _cumulative[outcome][end] - _cumulative[outcome][start])
+                                 for outcome in OUTCOMES)
+
+                for metric in _metrics:
+                    values[metric].append(METRICS[metric](confusion))
+
+            rolling_[window] = values
+
+        return rolling_
+
+    except:
+        raise
+
+
+def _getGroupedMetrics(_outcomes, _metrics, _group_by):
+    """
+    Calculates metrics per group of predictions.
+
+    :param _outcomes: (dict) prediction outcomes returned by loadPredictionOutcomes
+    :param _metrics: (list) metric names
+    :param _group_by: (string) 'market' or 'hour' (of the day, UTC)
+    :return: (dict) {group: {metric: value}}
+    """
+    try:
+        logger.info('getGroupedMetrics: Calculating metrics by: %s' % _group_by)
+
+        if _group_by == 'market':
+            keys = _outcomes['market']
+        elif _group_by == 'hour':
+            keys = [_getHourKey(unix_time) for unix_time in _outcomes['unix_time']]
+        else:
+            raise ValueError('Unknown grouping: %s' % _group_by)
+
+        #confusion counts: holds {group: {outcome: count}}
+        confusions = {}
+
+        for key, energy_in, energy_out in zip(keys, _outcomes['energy_in'], _outcomes['energy_out']):
+            confusion = confusions.get(key)
+            if confusion is None:
+                confusion = confusions[key] = dict.fromkeys(OUTCOMES, 0)
+
+            if energy_in == 1:
+                confusion['true_positive'] += 1
+            elif energy_in == -1:
+                confusion['false_positive'] += 1
+
+            if energy_out == 1:
+                confusion['true_negative'] += 1
+            elif energy_out == -1:
+                confusion['false_negative'] += 1
+
+        grouped_ = {}
+        for key, confusion in confusions.iteritems():
+            grouped_[key] = dict((metric, METRICS[metric](confusion)) for metric in _metrics)
+            grouped_[key].update(confusion)
+
+        return grouped_
+
+    except:
+        raise
+
+
+def getMetrics(_outcomes, _global_metrics=GLOBAL_METRICS, _rolling_metrics=ROLLING_METRICS,
+               _rolling_windows=ROLLING_WINDOWS, _group_by=GROUP_BY):
+    """
+    Evaluates prediction outcomes.
+
+    :param _outcomes: (dict) prediction outcomes returned by loadPredictionOutcomes
+    :param _global_metrics: (list) metrics calculated over all predictions and for every group
+    :param _rolling_metrics: (list) metrics calculated over sliding windows
+    :param _rolling_windows: (list) sliding window sizes
+    :param _group_by: (list) groupings, any of 'market' and 'hour'
+    :return: (dict) {'global': {metric: value}, 'rolling': {window: {metric: list}}, 'grouped': {grouping: {group:
+     {metric: value}}}}
+    """
+    try:
+        logger.info('getMetrics: Evaluating prediction outcomes.')
+
+        cumulative = _getCumulativeConfusion(_outcomes)
+
+        confusion = dict((outcome, cumulative[outcome][-1]) for outcome in OUTCOMES)
+        global_metrics = dict((metric, METRICS[metric](confusion)) for metric in _global_metrics)
+        global_metrics.update(confusion)
+
+        rolling_metrics = {}
+        for window, values in _getRollingMetrics(cumulative, _rolling_metrics, _rolling_windows).iteritems():
+            rolling_metrics[window] = dict((metric, array_.tolist()) for metric, array_ in values.iteritems())
+
+        grouped_metrics = {}
+        for grouping in _group_by:
+            grouped_metrics[grouping] = _getGroupedMetrics(_outcomes, _global_metrics, grouping)
+
+        return {'global': global_metrics, 'rolling': rolling_metrics, 'grouped': grouped_metrics}
+
+    except:
+        raise
@@ -18,10 +18,15 @@ VIRTUAL_CURRENCIES = ['LTC', 'SLL', 'WMZ']
 def displayProgress(_loop_index, _size_to_process, accuracy):
     try:
         if _loop_index % REFRESH_PROGRESS_EVERY_N_CYCLES == 0:
-            progress_percent = float(_loop_index) / float(_size_to_process) * 100
-
-            sys.stdout.write('%.5f%%, predicted_energy_in(#s=0) = %.5f, predicted_energy_out(#s>0) = %.5f\n'
-                             % (progress_percent, accuracy['global_statistics']['predicted_energy_in'],
+            #streamed data may come without a known size
+            if _size_to_process:
+                progress_percent = float(_loop_index) / float(_size_to_process) * 100
+                progress_text = '%.5f%%' % progress_percent
+            else:
+                progress_text = '%s trades' % _loop_index
+
+            sys.stdout.write('%s, predicted_energy_in(#s=0) = %.5f, predicted_energy_out(#s>0) = %.5f\n'
+                             % (progress_text, accuracy['global_statistics']['predicted_energy_in'],
                                 accuracy['global_statistics']['predicted_energy_out']))
 
     except:
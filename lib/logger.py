@@ -1,21 +1,236 @@
 # -*- coding: utf-8 -*-
 
+import atexit
+import collections
 import logging
 import logging.handlers
+import multiprocessing.util
+import os
+import threading
 import lib.io as tools
 
+#maximum number of log records waiting to be written
+LOG_QUEUE_SIZE = 10000
+#what to do with a record when the queue is full: 'block' until there is space or 'drop' it
+LOG_QUEUE_POLICY = 'block'
+#maximum number of log records written to the file at once
+LOG_WRITE_BATCH_SIZE = 1000
 
-def getCustomLogger(_file_name, _logging_level):
+
+class _QueueHandler(logging.Handler):
+    """
+    Passes log records to a background thread through a bounded queue.
+
+    The caller only merges the message with its arguments and appends the record to a deque, which needs no lock;
+    formatting, writing and rotation happen in the background thread, which is only woken when the queue was empty.
+    The thread writes records in batches: each record is formatted once (the rotating file handler formats it twice,
+    once to decide on rotation) and every batch takes one write, one flush and one rotation check. Records are dropped
+    or the caller blocks when the queue is full, depending on the policy.
+
+    A forked process inherits locks held by threads of its parent that do not exist in the child, so the first
+    record handled in a forked process recreates the locks of the target handler and starts a writer of its own,
+    which is stopped and flushed when the process exits.
+    """
+
+    def __init__(self, _target, _queue_size, _policy):
+        logging.Handler.__init__(self)
+        self.target = _target
+        self.queue_size = _queue_size
+        self.block = _policy == 'block'
+        self.dropped_records = 0
+        self._startWriter()
+
+    def _startWriter(self):
+        self.pid = os.getpid()
+        self.queue = collections.deque()
+        #set by the caller when it adds to an empty queue, by the writer when it takes from a full queue
+        self.not_empty = threading.Event()
+        self.not_full = threading.Event()
+        self.not_full.set()
+
+        self.thread = threading.Thread(target=self._writeRecords, name='log-writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _restartAfterFork(self):
+        #records queued by the parent are written by the parent
+        self.createLock()
+        self.target.createLock()
+        self.dropped_records = 0
+        self._startWriter()
+
+        #multiprocessing runs finalizers when its processes exit, atexit handlers are skipped
+        multiprocessing.util.Finalize(self, self._stopWriter, exitpriority=0)
+
+    def handle(self, record):
+        #no handler lock: the deque is safe to append to from any thread
+        if os.getpid() != self.pid:
+            self._restartAfterFork()
+
+        if self.filter(record):
+            self.emit(record)
+
+        return record
+
+    def emit(self, record):
+        try:
+            #arguments may change before the record is written, keep the message as it is now
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = logging._defaultFormatter.formatException(record.exc_info)
+                record.exc_info = None
+
+            queue = self.queue
+
+            while len(queue) >= self.queue_size:
+                if not self.block:
+                    self.dropped_records += 1
+                    return
+
+                self.not_full.clear()
+                if len(queue) >= self.queue_size:
+                    self.not_full.wait()
+
+            queue.append(record)
+
+            if not self.not_empty.is_set():
+                self.not_empty.set()
+
+        except (KeyboardInterrupt, SystemExit):
+            raise
+
+        except:
+            self.handleError(record)
+
+    def _writeRecords(self):
+        queue = self.queue
+        not_empty = self.not_empty
+        not_full = self.not_full
+
+        while True:
+            while queue:
+                batch = []
+                stop = False
+
+                while queue and len(batch) < LOG_WRITE_BATCH_SIZE:
+                    record = queue.popleft()
+
+                    #None signals the end of the session
+                    if record is None:
+                        stop = True
+                        break
+
+                    batch.append(record)
+
+                if not not_full.is_set():
+                    not_full.set()
+
+                self._writeBatch(batch)
+
+                if stop:
+                    return
+
+            not_empty.clear()
+            #a record added before the flag was cleared would not wake the writer
+            if not queue:
+                not_empty.wait()
+
+    def _writeBatch(self, _records):
+        target = self.target
+        lines = []
+
+        for record in _records:
+            if record.levelno < target.level:
+                continue
+
+            try:
+                line = target.format(record) + '\n'
+                if isinstance(line, unicode):
+                    line = line.encode('utf-8')
+                lines.append(line)
+            except Exception:
+                target.handleError(record)
+
+        if not lines:
+            return
+
+        text = ''.join(lines)
+
+        target.acquire()
+        try:
+            #rotate before the batch would grow the file past its limit
+            if target.maxBytes > 0:
+                target.stream.seek(0, 2)
+                if target.stream.tell() and target.stream.tell() + len(text) >= target.maxBytes:
+                    target.doRollover()
+
+            target.stream.write(text)
+            target.flush()
+        except Exception:
+            target.handleError(_records[-1])
+        finally:
+            target.release()
+
+    def _stopWriter(self):
+        if os.getpid() != self.pid or not self.thread.is_alive():
+            return
+
+        #always wait for space so the stop signal is not lost
+        while len(self.queue) >= self.queue_size:
+            self.not_full.clear()
+            if len(self.queue) >= self.queue_size:
+                self.not_full.wait()
+
+        self.queue.append(None)
+        self.not_empty.set()
+        self.thread.join()
+
+        if self.dropped_records:
+            self.target.handle(logging.makeLogRecord({
+                'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                'msg': 'QueueHandler: Dropped %s log records.' % self.dropped_records,
+            }))
+
+    def close(self):
+        self._stopWriter()
+        self.target.close()
+        logging.Handler.close(self)
+
+
+def getDroppedRecords(_logger):
+    """
+    Counts log records dropped because the logging queue was full.
+
+    :param _logger: (object) logger returned by getCustomLogger
+    :return: (int) number of dropped records
+    """
+    try:
+        return sum(handler.dropped_records for handler in _logger.handlers if isinstance(handler, _QueueHandler))
+
+    except:
+        raise
+
+
+def getCustomLogger(_file_name, _logging_level, _queue_size=LOG_QUEUE_SIZE, _policy=LOG_QUEUE_POLICY):
     """
     Creates a logger instance and configures it.
 
-    A logger instance is created configured to write to console and a file which is rotated every N bytes.
+    A logger instance is created configured to write to console and a file which is rotated every N bytes. Records
+    for the file are formatted and written by a background thread fed through a bounded queue.
 
     :param _file_name: (string) name of the logging file
     :param _logging_level: (int) level of logging i.e. logging.INFO, logging.DEBUG etc.
+    :param _queue_size: (int) maximum number of records waiting to be written to the file
+    :param _policy: (string) 'block' to wait for space in a full queue, 'drop' to discard the record
     :return: (object) logger instance
     """
     try:
+        #the formatter uses none of them, spare collecting them for every record
+        logging.logThreads = 0
+        logging.logProcesses = 0
+        logging.logMultiprocessing = 0
+
         logger = logging.getLogger()
         logger.setLevel(_logging_level)
 
@@ -37,11 +252,18 @@ def getCustomLogger(_file_name, _logging_level):
         fh.setFormatter(formatter)
         ch.setFormatter(formatter)
 
+        #move formatting and file I/O off the calling thread
+        qh = _QueueHandler(fh, _queue_size, _policy)
+        qh.setLevel(_logging_level)
+
+        #write what is left in the queue before exiting
+        atexit.register(qh.close)
+
         #add handlers to the logger
-        logger.addHandler(fh)
+        logger.addHandler(qh)
         logger.addHandler(ch)
 
         return logger
 
     except:
-        raise
\ No newline at end of file
+        raise
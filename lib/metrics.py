@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+"""
+Live metrics of long running builds and simulations.
+
+Metrics are kept in memory and updated from the processing loops. Updates from the simulation loop are throttled to
+the first trade, every REFRESH_METRICS_EVERY_N_CYCLES trades and the end of the simulation, so reporting costs next
+to nothing. When started, metrics are served in
+Prometheus text format on a local HTTP endpoint and/or periodically written to a file.
+"""
+
+import BaseHTTPServer
+import logging
+import os
+import resource
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+REFRESH_METRICS_EVERY_N_CYCLES = 1000
+METRICS_HOST = '127.0.0.1'
+METRICS_PATH = '/metrics'
+#seconds between two writes of the metrics file
+WRITE_METRICS_EVERY_N_SECONDS = 10
+
+#metrics: holds the latest values
+_metrics = {
+    'simulation': {
+        'trades_processed': 0,
+        'trades_total': 0,
+        'trades_per_second': 0.0,
+        'eta_seconds': 0.0,
+        'book_size': 0,
+        'accuracy': {},
+    },
+    #market progress: holds {stage: {market: 0 or 1}}
+    'markets': {'download': {}, 'normalize': {}},
+}
+#throttling state: holds time and index of the previous simulation update
+_last_update = {'time': None, 'trades_processed': 0}
+
+
+def updateSimulation(_loop_index, _size_to_process, _book_size, _track_accuracy, _final=False):
+    """
+    Updates simulation metrics.
+
+    Cheap enough to be called for every trade: the metrics are refreshed only on the first trade of a simulation, every
+    REFRESH_METRICS_EVERY_N_CYCLES calls and when the simulation ends.
+    :param _loop_index: (int) number of processed trades
+    :param _size_to_process: (int) number of trades to process, 0 if unknown
+    :param _book_size: (int) number of entries in the agent book
+    :param _track_accuracy: (map) model statistics: true/false positives/negatives
+    :param _final: (bool) True when the simulation has ended
+    :return: Nothing. Side effects: _metrics is changed.
+    """
+    try:
+        #a new simulation starts, the rate is measured from its first trade
+        if _loop_index == 1:
+            _last_update['time'] = None
+
+        if _loop_index % REFRESH_METRICS_EVERY_N_CYCLES == 0 or _loop_index == 1 or _final:
+            now = time.time()
+            simulation = _metrics['simulation']
+
+            #rate between this and the previous update
+            if (_last_update['time'] is not None and now > _last_update['time'] and
+                    _loop_index > _last_update['trades_processed']):
+                simulation['trades_per_second'] = ((_loop_index - _last_update['trades_processed']) /
+                                                   (now - _last_update['time']))
+
+            if _final:
+                #the last trade only gives the future price, so fewer trades than counted are processed
+                _size_to_process = _loop_index
+                simulation['eta_seconds'] = 0.0
+            elif simulation['trades_per_second'] and _size_to_process:
+                simulation['eta_seconds'] = (_size_to_process - _loop_index) / simulation['trades_per_second']
+
+            simulation['trades_processed'] = _loop_index
+            simulation['trades_total'] = _size_to_process
+            simulation['book_size'] = _book_size
+            simulation['accuracy'] = dict(_track_accuracy)
+
+            _last_update['time'] = now
+            _last_update['trades_processed'] = _loop_index
+
+    except:
+        raise
+
+
+def setMarketProgress(_stage, _market, _done):
+    """
+    Records progress of a market in a build stage.
+
+    :param _stage: (string) 'download' or 'normalize'
+    :param _market: (string) market name
+    :param _done: (bool) True when the market has been processed
+    :return: Nothing. Side effects: _metrics is changed.
+    """
+    try:
+        _metrics['markets'].setdefault(_stage, {})[_market] = 1 if _done else 0
+
+    except:
+        raise
+
+
+def _getResidentMemory():
+    """
+    Retrieves resident memory of the process.
+
+    :return: (int) resident memory in bytes
+    """
+    try:
+        #current resident memory is only available on Linux
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+
+    except (IOError, OSError):
+        #peak resident memory, in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def getMetricsText():
+    """
+    Formats metrics in Prometheus text format.
+
+    :return: (string) metrics
+    """
+    try:
+        simulation = _metrics['simulation']
+        lines = []
+
+        def addMetric(_name, _type, _help, _samples):
+            lines.append('# HELP %s %s' % (_name, _help))
+            lines.append('# TYPE %s %s' % (_name, _type))
+            for labels, value in _samples:
+                label_text = ','.join('%s="%s"' % (key, labels[key]) for key in sorted(labels))
+                lines.append('%s%s %s' % (_name, '{%s}' % label_text if label_text else '', value))
+
+        addMetric('simulation_trades_processed', 'counter', 'Trades simulated so far.',
+                  [({}, simulation['trades_processed'])])
+        addMetric('simulation_trades_total', 'gauge', 'Trades to simulate.', [({}, simulation['trades_total'])])
+        addMetric('simulation_trades_per_second', 'gauge', 'Simulated trades per second.',
+                  [({}, '%.3f' % simulation['trades_per_second'])])
+        addMetric('simulation_eta_seconds', 'gauge', 'Estimated seconds until the simulation ends.',
+                  [({}, '%.1f' % simulation['eta_seconds'])])
+        addMetric('simulation_book_size', 'gauge', 'Entries in the agent book.', [({}, simulation['book_size'])])
+        addMetric('simulation_predictions', 'counter', 'Prediction outcomes so far.',
+                  [({'outcome': outcome}, count) for outcome, count in sorted(simulation['accuracy'].iteritems())])
+        addMetric('process_resident_memory_bytes', 'gauge', 'Resident memory size in bytes.',
+                  [({}, _getResidentMemory())])
+
+        market_samples = []
+        for stage, markets in sorted(_metrics['markets'].iteritems()):
+            for market, done in sorted(markets.iteritems()):
+                market_samples.append(({'stage': stage, 'market': market}, done))
+        addMetric('build_market_done', 'gauge', 'Markets processed by a build stage (1 done, 0 in progress).',
+                  market_samples)
+
+        return '\n'.join(lines) + '\n'
+
+    except:
+        raise
+
+
+class _MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serves metrics on METRICS_PATH.
+    """
+
+    def do_GET(self):
+        if self.path != METRICS_PATH:
+            self.send_error(404)
+            return
+
+        body = getMetricsText()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, _format, *args):
+        logger.debug('MetricsHandler: ' + _format % args)
+
+
+def _writeMetricsFile(_file_path):
+    """
+    Periodically writes metrics to a file.
+
+    :param _file_path: (string) path of the metrics file
+    :return: Nothing. Side effects: saves data to disk.
+    """
+    while True:
+        try:
+            #write to a temporary file first so readers never see a partial file
+            tmp_file_path = _file_path + '.tmp'
+            with open(tmp_file_path, 'w') as f:
+                f.write(getMetricsText())
+            os.rename(tmp_file_path, _file_path)
+
+        except Exception:
+            logger.exception('writeMetricsFile: Unhandled exception: ')
+
+        time.sleep(WRITE_METRICS_EVERY_N_SECONDS)
+
+
+def startMetrics(_port=None, _file_path=None):
+    """
+    Starts publishing metrics in background threads.
+
+    :param _port: (int) port of the local HTTP endpoint, None to disable it
+    :param _file_path: (string) path of the periodically written metrics file, None to disable it
+    :return: Nothing. Side effects: starts daemon threads.
+    """
+    try:
+        logger.info('startMetrics: Publishing metrics on port: %s, to file: %s' % (_port, _file_path))
+
+        if _port is not None:
+            server = BaseHTTPServer.HTTPServer((METRICS_HOST, _port), _MetricsHandler)
+            server_thread = threading.Thread(target=server.serve_forever, name='metrics-server')
+            server_thread.daemon = True
+            server_thread.start()
+
+            print 'Serving metrics on: http://%s:%s%s' % (METRICS_HOST, _port, METRICS_PATH)
+
+        if _file_path is not None:
+            writer_thread = threading.Thread(target=_writeMetricsFile, args=(_file_path,), name='metrics-writer')
+            writer_thread.daemon = True
+            writer_thread.start()
+
+    except:
+        raise
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+
+"""
+Sampling profiler for long running sessions.
+
+A profiling timer interrupts the process every SAMPLING_INTERVAL seconds of CPU time and the signal handler records
+the current call stack. Since only stacks are counted the overhead is independent of how many functions are called.
+At the end of the session collapsed stacks, a flamegraph and a per-function summary are written to the log folder.
+"""
+
+import cgi
+import logging
+import os
+import signal
+import lib.io as tools
+
+logger = logging.getLogger(__name__)
+#seconds of CPU time between two samples
+SAMPLING_INTERVAL = 0.005
+PROFILE_DIR = 'logs/'
+FLAMEGRAPH_WIDTH = 1200
+FLAMEGRAPH_FRAME_HEIGHT = 16
+#frames narrower than this (in pixels) are not drawn
+FLAMEGRAPH_MINIMUM_WIDTH = 0.1
+
+#profiler state: holds sampled stacks and the trade range to sample
+_state = {
+    'running': False,
+    'name': None,
+    'stacks': {},
+    'trade_range': None,
+    'current_trade': 0,
+}
+
+
+def _getFrameName(_frame):
+    """
+    Formats a frame as module.function.
+
+    :param _frame: (frame) stack frame
+    :return: (string) frame name
+    """
+    module = _frame.f_globals.get('__name__', '?')
+
+    return '%s.%s' % (module, _frame.f_code.co_name)
+
+
+def _sample(_signal_number, _frame):
+    """
+    Records the interrupted call stack.
+
+    :param _signal_number: (int) received signal
+    :param _frame: (frame) interrupted frame
+    :return: Nothing. Side effects: _state is changed.
+    """
+    trade_range = _state['trade_range']
+
+    #sample only the requested trades
+    if trade_range and not trade_range[0] <= _state['current_trade'] <= trade_range[1]:
+        return
+
+    stack = []
+    while _frame is not None:
+        stack.append(_getFrameName(_frame))
+        _frame = _frame.f_back
+
+    #collapsed stacks are written from the root to the leaf
+    stack.reverse()
+    key = ';'.join(stack)
+    _state['stacks'][key] = _state['stacks'].get(key, 0) + 1
+
+
+def setCurrentTrade(_trade_index):
+    """
+    Tells the profiler which trade is being processed.
+
+    :param _trade_index: (int) index of the trade being processed, counted from 1, 0 when none is
+    :return: Nothing. Side effects: _state is changed.
+    """
+    _state['current_trade'] = _trade_index
+
+
+def startProfiler(_file_name, _trade_range=None):
+    """
+    Starts sampling the process.
+
+    :param _file_name: (string) name of the profiled script, used to name output files
+    :param _trade_range: (tuple) first and last trade index to sample, None to sample the whole session
+    :return: Nothing. Side effects: installs a SIGPROF handler.
+    """
+    try:
+        logger.info('startProfiler: Starting profiler, trade range: %s' % (_trade_range,))
+
+        _state['name'] = os.path.basename(_file_name).split('.')[0]
+        _state['stacks'] = {}
+        _state['trade_range'] = _trade_range
+        _state['current_trade'] = 0
+        _state['running'] = True
+
+        signal.signal(signal.SIGPROF, _sample)
+        signal.setitimer(signal.ITIMER_PROF, SAMPLING_INTERVAL, SAMPLING_INTERVAL)
+
+    except:
+        raise
+
+
+def _getFunctionSummary(_stacks):
+    """
+    Counts self and total samples for every function.
+
+    :param _stacks: (dict) sampled stacks: {'root;...;leaf': samples}
+    :return: (list) [(function, self samples, total samples)] ordered by total samples
+    """
+    try:
+        self_samples = {}
+        total_samples = {}
+
+        for stack, samples in _stacks.iteritems():
+            frames = stack.split(';')
+            self_samples[frames[-1]] = self_samples.get(frames[-1], 0) + samples
+
+            #count recursive functions only once per stack
+            for function in set(frames):
+                total_samples[function] = total_samples.get(function, 0) + samples
+
+        summary_ = [(function, self_samples.get(function, 0), total) for function, total in total_samples.iteritems()]
+        summary_.sort(key=lambda item: (-item[2], -item[1]))
+
+        return summary_
+
+    except:
+        raise
+
+
+def _getFlamegraph(_stacks):
+    """
+    Renders sampled stacks as a flamegraph.
+
+    :param _stacks: (dict) sampled stacks: {'root;...;leaf': samples}
+    :return: (string) SVG document
+    """
+    try:
+        #build the call tree: every node is {'samples': int, 'children': {name: node}}
+        root = {'samples': 0, 'children': {}}
+        depth = 0
+
+        for stack, samples in _stacks.iteritems():
+            node = root
+            node['samples'] += samples
+            frames = stack.split(';')
+            depth = max(depth, len(frames))
+
+            for frame in frames:
+                node = node['children'].setdefault(frame, {'samples': 0, 'children': {}})
+                node['samples'] += samples
+
+        height = (depth + 1) * FLAMEGRAPH_FRAME_HEIGHT
+        scale = float(FLAMEGRAPH_WIDTH) / root['samples'] if root['samples'] else 0
+
+        rectangles = []
+        #walk the tree: holds (name, node, x, level)
+        pending = [('all', root, 0.0, 0)]
+        while pending:
+            name, node, x, level = pending.pop()
+            width = node['samples'] * scale
+
+            if width < FLAMEGRAPH_MINIMUM_WIDTH:
+                continue
+
+            y = height - (level + 1) * FLAMEGRAPH_FRAME_HEIGHT
+            label = cgi.escape(name, quote=True)
+            percent = 100.0 * node['samples'] / root['samples']
+            rectangles.append(
+                '<g><title>%s (%s samples, %.2f%%)</title>'
+                '<rect x="%.2f" y="%s" width="%.2f" height="%s" fill="rgb(%s,%s,60)" stroke="white"/>'
+                '<text x="%.2f" y="%s" font-size="11" font-family="monospace">%s</text></g>'
+                % (label, node['samples'], percent, x, y, width, FLAMEGRAPH_FRAME_HEIGHT - 1,
+                   200 + hash(name) % 55, 80 + hash(name) % 120, x + 2, y + FLAMEGRAPH_FRAME_HEIGHT - 4,
+                   label[:int(width / 7)])
+            )
+
+            child_x = x
+            for child_name in sorted(node['children']):
+                child = node['children'][child_name]
+                pending.append((child_name, child, child_x, level + 1))
+                child_x += child['samples'] * scale
+
+        return ('<?xml version="1.0" standalone="no"?>\n'
+                '<svg version="1.1" width="%s" height="%s" xmlns="http://www.w3.org/2000/svg">\n%s\n</svg>\n'
+                % (FLAMEGRAPH_WIDTH, height, '\n'.join(rectangles)))
+
+    except:
+        raise
+
+
+def stopProfiler():
+    """
+    Stops sampling and writes collapsed stacks, a flamegraph and a per-function summary to the log folder.
+
+    :return: Nothing. Side effects: saves data to disk.
+    """
+    try:
+        if not _state['running']:
+            return
+
+        logger.info('stopProfiler: Stopping profiler.')
+
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+        _state['running'] = False
+
+        stacks = _state['stacks']
+        total = sum(stacks.itervalues())
+
+        tools.createFolder(PROFILE_DIR)
+        base_name = PROFILE_DIR + _state['name'] + '_profile'
+
+        #collapsed stacks, compatible with flamegraph.pl
+        with open(base_name + '.collapsed', 'w') as f:
+            for stack in sorted(stacks):
+                f.write('%s %s\n' % (stack, stacks[stack]))
+
+        with open(base_name + '.svg', 'w') as f:
+            f.write(_getFlamegraph(stacks))
+
+        with open(base_name + '_summary.txt', 'w') as f:
+            f.write('%10s %8s %10s %8s  %s\n' % ('self', 'self%', 'total', 'total%', 'function'))
+
+            for function, self_samples, total_samples in _getFunctionSummary(stacks):
+                f.write('%10s %7.2f%% %10s %7.2f%%  %s\n' % (self_samples, 100.0 * self_samples / total,
+                                                               total_samples, 100.0 * total_samples / total,
+                                                               function))
+
+        logger.info('stopProfiler: Saved %s samples to: %s' % (total, base_name))
+
+    except:
+        raise
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+
+"""
+Functions to build and query level-of-detail pyramids of simulation results.
+
+A pyramid holds the key simulation series at full resolution (level 0) and at successively coarser levels where every
+bucket summarizes PYRAMID_FACTOR buckets of the level below by their min, max and mean. Plotting then only needs to
+read the level matching the requested time range and pixel width instead of the whole simulation.
+
+File layout (native byte order):
+    header: magic, factor, number of series, number of levels, number of points
+    series names: length prefixed strings
+    level sizes: number of buckets per level
+    per level: bucket start times ('d'), then per series: values ('f') for level 0, min, max, mean ('f') otherwise
+"""
+
+import array
+import bisect
+import logging
+import struct
+
+logger = logging.getLogger(__name__)
+PYRAMID_MAGIC = 'LODP'
+PYRAMID_FACTOR = 4
+#stop adding levels once a level has fewer buckets than this
+MINIMUM_LEVEL_SIZE = 256
+HEADER_FORMAT = '=4sIIIQ'
+#series names and where to find them in a simulated response
+PYRAMID_SERIES = [
+    ('trade_price', ('trade_price',)),
+    ('forecasted_sell_volume', ('forecast', 'forecasted_sell_volume')),
+    ('local_relative_positives', ('statistics', 'local_statistics', 'local_relative_positives')),
+    ('local_relative_negatives', ('statistics', 'local_statistics', 'local_relative_negatives')),
+    ('global_relative_positives', ('statistics', 'global_statistics', 'global_relative_positives')),
+    ('global_relative_negatives', ('statistics', 'global_statistics', 'global_relative_negatives')),
+]
+TIME_TYPE = 'd'
+VALUE_TYPE = 'f'
+
+
+def _getSeriesValue(_response, _path):
+    """
+    Retrieves a nested value from a simulated response.
+
+    :param _response: (dict) single simulated response
+    :param _path: (tuple) keys leading to the value
+    :return: (float) value
+    """
+    try:
+        value = _response
+
+        for key in _path:
+            value = value[key]
+
+        return value
+
+    except:
+        raise
+
+
+def _getCoarserLevel(_times, _level, _bucket_size, _size):
+    """
+    Summarizes a level into PYRAMID_FACTOR times fewer buckets.
+
+    :param _times: (array) bucket start times of the finer level
+    :param _level: (dict) series of the finer level: {name: {'min': array, 'max': array, 'mean': array}}
+    :param _bucket_size: (int) number of points summarized by one bucket of the finer level
+    :param _size: (int) number of points at level 0
+    :return: (dict) coarser level: {'times': array, 'series': {name: {'min': array, 'max': array, 'mean': array}}}
+    """
+    try:
+        logger.info('getCoarserLevel: Building pyramid level.')
+
+        times_ = array.array(TIME_TYPE)
+        series_ = {}
+
+        for name in _level:
+            series_[name] = {'min': array.array(VALUE_TYPE), 'max': array.array(VALUE_TYPE),
+                             'mean': array.array(VALUE_TYPE)}
+
+        for start in xrange(0, len(_times), PYRAMID_FACTOR):
+            end = min(start + PYRAMID_FACTOR, len(_times))
+            times_.append(_times[start])
+
+            #the last bucket of a level may summarize fewer points
+            counts = [min(_bucket_size, _size - index * _bucket_size) for index in xrange(start, end)]
+            count_sum = float(sum(counts))
+
+            for name, values in _level.iteritems():
+                series_[name]['min'].append(min(values['min'][start:end]))
+                series_[name]['max'].append(max(values['max'][start:end]))
+
+                weighted_sum = 0.0
+                for offset, count in enumerate(counts):
+                    weighted_sum += values['mean'][start + offset] * count
+                series_[name]['mean'].append(weighted_sum / count_sum)
+
+        return {'times': times_, 'series': series_}
+
+    except:
+        raise
+
+
+def buildPyramid(_file_path, _simulated_responses):
+    """
+    Builds a level-of-detail pyramid over simulation results and saves it.
+
+    Responses without 'unix_time' (results of older simulations) are placed on their index instead.
+    :param _file_path: (string) path of the pyramid file
+    :param _simulated_responses: (list) responses returned by lib.agents.getAgentReactions
+    :return: (int) number of levels. Side effects: saves data to disk.
+    """
+    try:
+        logger.info('buildPyramid: Building level-of-detail pyramid.')
+
+        size = len(_simulated_responses)
+
+        #level 0 holds the series at full resolution
+        times = array.array(TIME_TYPE)
+        level = {}
+
+        for name, path in PYRAMID_SERIES:
+            values = array.array(VALUE_TYPE, [_getSeriesValue(response, path) for response in _simulated_responses])
+            level[name] = {'min': values, 'max': values, 'mean': values}
+
+        for index, response in enumerate(_simulated_responses):
+            times.append(response.get('unix_time', index))
+
+        levels = [{'times': times, 'series': level}]
+
+        #add coarser levels until they are small enough to be plotted at once
+        bucket_size = 1
+        while len(levels[-1]['times']) > MINIMUM_LEVEL_SIZE:
+            levels.append(_getCoarserLevel(levels[-1]['times'], levels[-1]['series'], bucket_size, size))
+            bucket_size *= PYRAMID_FACTOR
+
+        logger.info('buildPyramid: Saving %s levels to: %s' % (len(levels), _file_path))
+
+        with open(_file_path, 'wb') as f:
+            f.write(struct.pack(HEADER_FORMAT, PYRAMID_MAGIC, PYRAMID_FACTOR, len(PYRAMID_SERIES), len(levels), size))
+
+            for name, path in PYRAMID_SERIES:
+                f.write(struct.pack('=H', len(name)))
+                f.write(name)
+
+            for lvl in levels:
+                f.write(struct.pack('=Q', len(lvl['times'])))
+
+            for level_index, lvl in enumerate(levels):
+                lvl['times'].tofile(f)
+
+                for name, path in PYRAMID_SERIES:
+                    #min, max and mean are the same at full resolution
+                    if level_index == 0:
+                        lvl['series'][name]['mean'].tofile(f)
+                    else:
+                        lvl['series'][name]['min'].tofile(f)
+                        lvl['series'][name]['max'].tofile(f)
+                        lvl['series'][name]['mean'].tofile(f)
+
+        return len(levels)
+
+    except:
+        raise
+
+
+def _readHeader(_f):
+    """
+    Reads the pyramid header and computes offsets of every stored array.
+
+    :param _f: (file) opened pyramid file
+    :return: (dict) header: {'factor': int, 'series': list, 'level_sizes': list, 'level_offsets': list}
+    """
+    try:
+        header_size = struct.calcsize(HEADER_FORMAT)
+        magic, factor, number_of_series, number_of_levels, size = struct.unpack(HEADER_FORMAT, _f.read(header_size))
+
+        if magic != PYRAMID_MAGIC:
+            raise ValueError('Not a pyramid file.')
+
+        series = []
+        for i in xrange(number_of_series):
+            name_size = struct.unpack('=H', _f.read(2))[0]
+            series.append(_f.read(name_size))
+
+        level_sizes = [struct.unpack('=Q', _f.read(8))[0] for i in xrange(number_of_levels)]
+
+        #arrays follow each other so their offsets are known from the sizes
+        time_item_size = array.array(TIME_TYPE).itemsize
+        value_item_size = array.array(VALUE_TYPE).itemsize
+
+        level_offsets = []
+        offset = _f.tell()
+        for level_index, level_size in enumerate(level_sizes):
+            level_offsets.append(offset)
+            arrays_per_series = 1 if level_index == 0 else 3
+            offset += level_size * time_item_size + number_of_series * arrays_per_series * level_size * value_item_size
+
+        return {'factor': factor, 'series': series, 'level_sizes': level_sizes, 'level_offsets': level_offsets}
+
+    except:
+        raise
+
+
+def _readArray(_f, _type_code, _offset, _start, _end):
+    """
+    Reads a slice of an array stored on disk.
+
+    :param _f: (file) opened pyramid file
+    :param _type_code: (string) array type code
+    :param _offset: (int) position of the first array element in the file
+    :param _start: (int) index of the first element to read
+    :param _end: (int) index after the last element to read
+    :return: (array) requested elements
+    """
+    try:
+        array_ = array.array(_type_code)
+        _f.seek(_offset + _start * array_.itemsize)
+        array_.fromfile(_f, _end - _start)
+
+        return array_
+
+    except:
+        raise
+
+
+class _DiskTimes(object):
+    """
+    Sequence view of a time array stored on disk, used for binary search without loading the array.
+    """
+
+    def __init__(self, _f, _offset, _size):
+        self.f = _f
+        self.offset = _offset
+        self.size = _size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, _index):
+        return _readArray(self.f, TIME_TYPE, self.offset, _index, _index + 1)[0]
+
+
+def getPyramidRange(_file_path, _start_time, _end_time, _pixel_width):
+    """
+    Retrieves the coarsest level detailed enough to fill the requested pixel width.
+
+    :param _file_path: (string) path of the pyramid file
+    :param _start_time: (float) start of the time range (inclusive)
+    :param _end_time: (float) end of the time range (inclusive)
+    :param _pixel_width: (int) number of horizontal pixels available for plotting
+    :return: (dict) {'level': int, 'bucket_size': int, 'unix_time': list, 'series': {name: {'min': list,
+     'max': list, 'mean': list}}}
+    """
+    try:
+        logger.info('getPyramidRange: Querying pyramid: %s' % _file_path)
+
+        with open(_file_path, 'rb') as f:
+            header = _readHeader(f)
+            factor = header['factor']
+            level_sizes = header['level_sizes']
+            level_offsets = header['level_offsets']
+
+            #find the requested range at full resolution
+            times = _DiskTimes(f, level_offsets[0], level_sizes[0])
+            start = bisect.bisect_left(times, _start_time)
+            end = bisect.bisect_right(times, _end_time)
+
+            #pick the finest level that still fits in the pixel width
+            level = 0
+            bucket_size = 1
+            while level < len(level_sizes) - 1 and (end - start + bucket_size - 1) // bucket_size > _pixel_width:
+                level += 1
+                bucket_size *= factor
+
+            bucket_start = start // bucket_size
+            bucket_end = min((end + bucket_size - 1) // bucket_size, level_sizes[level])
+            level_size = level_sizes[level]
+            value_item_size = array.array(VALUE_TYPE).itemsize
+            offset = level_offsets[level]
+
+            range_ = {
+                'level': level,
+                'bucket_size': bucket_size,
+                'unix_time': _readArray(f, TIME_TYPE, offset, bucket_start, bucket_end).tolist(),
+                'series': {},
+            }
+
+            offset += level_size * array.array(TIME_TYPE).itemsize
+
+            for name in header['series']:
+                if level == 0:
+                    values = _readArray(f, VALUE_TYPE, offset, bucket_start, bucket_end).tolist()
+                    range_['series'][name] = {'min': values, 'max': values, 'mean': values}
+                    offset += level_size * value_item_size
+
+                else:
+                    range_['series'][name] = {}
+                    for statistic in ('min', 'max', 'mean'):
+                        range_['series'][name][statistic] = _readArray(f, VALUE_TYPE, offset, bucket_start,
+                                                                       bucket_end).tolist()
+                        offset += level_size * value_item_size
+
+        return range_
+
+    except:
+        raise
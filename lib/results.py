@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+
+"""
+Functions to store and query simulation results in SQLite.
+
+Every simulation is a run with its metadata in the 'runs' table; responses go to the 'results' table indexed by run id
+and time, so date ranges and comparisons between runs are answered from the index instead of loading whole result
+files.
+"""
+
+import json
+import logging
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+#number of responses inserted in one transaction
+RESULTS_BATCH_SIZE = 100000
+#results columns: name, SQL type and where to find the value in a simulated response
+RESULT_COLUMNS = [
+    ('unix_time', 'REAL', ('unix_time',)),
+    ('market', 'TEXT', ('market',)),
+    ('trade_price', 'REAL', ('trade_price',)),
+    ('forecasted_sell_volume', 'REAL', ('forecast', 'forecasted_sell_volume')),
+    ('number_of_buy_events', 'INTEGER', ('forecast', 'number_of_buy_events')),
+    ('vol_from_outer_sys', 'REAL', ('forecast', 'vol_from_outer_sys')),
+    ('predicted_energy_in', 'INTEGER', ('statistics', 'global_statistics', 'predicted_energy_in')),
+    ('predicted_energy_out', 'INTEGER', ('statistics', 'global_statistics', 'predicted_energy_out')),
+    ('global_relative_positives', 'REAL', ('statistics', 'global_statistics', 'global_relative_positives')),
+    ('global_relative_negatives', 'REAL', ('statistics', 'global_statistics', 'global_relative_negatives')),
+    ('local_relative_positives', 'REAL', ('statistics', 'local_statistics', 'local_relative_positives')),
+    ('local_relative_negatives', 'REAL', ('statistics', 'local_statistics', 'local_relative_negatives')),
+]
+
+
+def _connect(_results_database):
+    """
+    Opens the results database and creates its tables if needed.
+
+    :param _results_database: (string) path of the SQLite file
+    :return: (object) connection
+    """
+    try:
+        connection = sqlite3.connect(_results_database)
+
+        connection.execute('CREATE TABLE IF NOT EXISTS runs (run_id INTEGER PRIMARY KEY, database TEXT, '
+                           'greed TEXT, parameters TEXT, created REAL, size INTEGER)')
+        connection.execute('CREATE TABLE IF NOT EXISTS results (run_id INTEGER, response_index INTEGER, %s)' %
+                           ', '.join('%s %s' % (name, sql_type) for name, sql_type, path in RESULT_COLUMNS))
+        connection.execute('CREATE INDEX IF NOT EXISTS results_run_time ON results (run_id, unix_time)')
+        connection.commit()
+
+        return connection
+
+    except:
+        raise
+
+
+def _getRow(_run_id, _response_index, _response):
+    """
+    Flattens a simulated response into a results row.
+
+    :param _run_id: (int) run id
+    :param _response_index: (int) position of the response in the simulation
+    :param _response: (dict) simulated response
+    :return: (tuple) row values
+    """
+    try:
+        row = [_run_id, _response_index]
+
+        for name, sql_type, path in RESULT_COLUMNS:
+            value = _response
+            for key in path:
+                #results of older simulations miss some values
+                value = value.get(key) if value is not None else None
+            row.append(value)
+
+        return tuple(row)
+
+    except:
+        raise
+
+
+def storeRun(_results_database, _database_name, _greed, _simulated_responses, _parameters=None):
+    """
+    Stores a simulation run.
+
+    :param _results_database: (string) path of the SQLite file
+    :param _database_name: (string) name of the simulated market database
+    :param _greed: (float or list) greed or greed histogram of the simulated agents
+    :param _simulated_responses: (iterable) responses returned by lib.agents.getAgentReactions
+    :param _parameters: (dict) further simulation parameters to keep with the run
+    :return: (int) run id. Side effects: saves data to disk.
+    """
+    try:
+        logger.info('storeRun: Storing simulation results in: %s' % _results_database)
+
+        connection = _connect(_results_database)
+
+        try:
+            cursor = connection.execute('INSERT INTO runs (database, greed, parameters, created, size) '
+                                        'VALUES (?, ?, ?, ?, 0)',
+                                        (_database_name, json.dumps(_greed), json.dumps(_parameters or {}),
+                                         time.time()))
+            run_id = cursor.lastrowid
+
+            insert = 'INSERT INTO results VALUES (%s)' % ', '.join(['?'] * (len(RESULT_COLUMNS) + 2))
+            batch = []
+            size = 0
+
+            #large transactions: one commit per batch
+            for response_index, response in enumerate(_simulated_responses):
+                batch.append(_getRow(run_id, response_index, response))
+
+                if len(batch) == RESULTS_BATCH_SIZE:
+                    connection.executemany(insert, batch)
+                    connection.commit()
+                    size += len(batch)
+                    batch = []
+
+            connection.executemany(insert, batch)
+            size += len(batch)
+
+            connection.execute('UPDATE runs SET size = ? WHERE run_id = ?', (size, run_id))
+            connection.commit()
+
+        finally:
+            connection.close()
+
+        logger.info('storeRun: Stored run %s with %s responses.' % (run_id, size))
+
+        return run_id
+
+    except:
+        raise
+
+
+def getRuns(_results_database):
+    """
+    Lists stored runs.
+
+    :param _results_database: (string) path of the SQLite file
+    :return: (list) [{'run_id': int, 'database': string, 'greed': float or list, 'parameters': dict,
+     'created': float, 'size': int}]
+    """
+    try:
+        logger.info('getRuns: Listing runs in: %s' % _results_database)
+
+        connection = _connect(_results_database)
+
+        try:
+            runs_ = []
+            for run_id, database, greed, parameters, created, size in connection.execute(
+                    'SELECT run_id, database, greed, parameters, created, size FROM runs ORDER BY run_id'):
+                runs_.append({'run_id': run_id, 'database': database, 'greed': json.loads(greed),
+                              'parameters': json.loads(parameters), 'created': created, 'size': size})
+
+        finally:
+            connection.close()
+
+        return runs_
+
+    except:
+        raise
+
+
+def getResults(_results_database, _run_id, _start_time=None, _end_time=None, _columns=None):
+    """
+    Retrieves responses of a run in a time range.
+
+    :param _results_database: (string) path of the SQLite file
+    :param _run_id: (int) run id
+    :param _start_time: (float) start of the time range (inclusive), None for no limit
+    :param _end_time: (float) end of the time range (inclusive), None for no limit
+    :param _columns: (list) names of RESULT_COLUMNS to retrieve, None for all
+    :return: (list) rows as dicts ordered by time
+    """
+    try:
+        logger.info('getResults: Querying run %s from %s to %s' % (_run_id, _start_time, _end_time))
+
+        known_columns = [name for name, sql_type, path in RESULT_COLUMNS]
+        columns = _columns or known_columns
+
+        for column in columns:
+            if column not in known_columns:
+                raise ValueError('Unknown column: %s' % column)
+
+        query = 'SELECT %s FROM results WHERE run_id = ?' % ', '.join(columns)
+        arguments = [_run_id]
+
+        if _start_time is not None:
+            query += ' AND unix_time >= ?'
+            arguments.append(_start_time)
+        if _end_time is not None:
+            query += ' AND unix_time <= ?'
+            arguments.append(_end_time)
+
+        query += ' ORDER BY unix_time, response_index'
+
+        connection = _connect(_results_database)
+
+        try:
+            results_ = [dict(zip(columns, row)) for row in connection.execute(query, arguments)]
+
+        finally:
+            connection.close()
+
+        return results_
+
+    except:
+        raise
+
+
+def getAccuracy(_results_database, _run_ids, _start_time=None, _end_time=None):
+    """
+    Compares prediction accuracy of runs in a time range.
+
+    :param _results_database: (string) path of the SQLite file
+    :param _run_ids: (list) run ids
+    :param _start_time: (float) start of the time range (inclusive), None for no limit
+    :param _end_time: (float) end of the time range (inclusive), None for no limit
+    :return: (dict) {run_id: {'true_positive': int, 'false_positive': int, 'true_negative': int,
+     'false_negative': int, 'relative_positives': float, 'relative_negatives': float}}
+    """
+    try:
+        logger.info('getAccuracy: Comparing runs: %s' % _run_ids)
+
+        accuracy_ = {}
+        connection = _connect(_results_database)
+
+        try:
+            for run_id in _run_ids:
+                query = ('SELECT '
+                         'TOTAL(predicted_energy_in = 1), TOTAL(predicted_energy_in = -1), '
+                         'TOTAL(predicted_energy_out = 1), TOTAL(predicted_energy_out = -1) '
+                         'FROM results WHERE run_id = ?')
+                arguments = [run_id]
+
+                if _start_time is not None:
+                    query += ' AND unix_time >= ?'
+                    arguments.append(_start_time)
+                if _end_time is not None:
+                    query += ' AND unix_time <= ?'
+                    arguments.append(_end_time)
+
+                true_positive, false_positive, true_negative, false_negative = [
+                    int(count) for count in connection.execute(query, arguments).fetchone()]
+
+                no_pos = true_positive + false_positive
+                no_neg = true_negative + false_negative
+
+                accuracy_[run_id] = {
+                    'true_positive': true_positive,
+                    'false_positive': false_positive,
+                    'true_negative': true_negative,
+                    'false_negative': false_negative,
+                    'relative_positives': float(true_positive) / no_pos if no_pos else 0,
+                    'relative_negatives': float(true_negative) / no_neg if no_neg else 0,
+                }
+
+        finally:
+            connection.close()
+
+        return accuracy_
+
+    except:
+        raise
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+"""
+Periodic snapshots of the simulated agent book.
+
+The book (entry prices of holders and their volume) is summarized as a histogram of price levels. Every snapshot only
+stores price levels whose volume changed since the previous snapshot, with a full snapshot (keyframe) every
+SNAPSHOT_KEYFRAME_EVERY snapshots, so the book at any time is rebuilt from the nearest keyframe without replaying the
+simulation.
+
+File layout (native byte order):
+    header: magic, price level width
+    per snapshot: unix time, keyframe flag, number of price levels, then (price level index, volume) per level;
+     a volume of 0 removes the price level
+"""
+
+import bisect
+import logging
+import math
+import struct
+
+logger = logging.getLogger(__name__)
+SNAPSHOT_MAGIC = 'BKSN'
+HEADER_FORMAT = '=4sd'
+RECORD_FORMAT = '=dBI'
+LEVEL_FORMAT = 'qd'
+#every n-th snapshot is stored in full
+SNAPSHOT_KEYFRAME_EVERY = 100
+
+
+def _getHistogram(_bought, _bin_width):
+    """
+    Sums book volume per price level.
+
+    :param _bought: (list) container holding all buying events: [(_trade_price, _traded_amount)]
+    :param _bin_width: (float) width of a price level in USD
+    :return: (dict) {price level index: volume}
+    """
+    try:
+        histogram_ = {}
+
+        for bought_price, bought_amount in _bought:
+            level = int(math.floor(bought_price / _bin_width))
+            histogram_[level] = histogram_.get(level, 0) + bought_amount
+
+        return histogram_
+
+    except:
+        raise
+
+
+class BookSnapshotWriter(object):
+    """
+    Writes book snapshots every _interval seconds of simulated time.
+    """
+
+    def __init__(self, _file_path, _interval, _bin_width):
+        logger.info('BookSnapshotWriter: Writing book snapshots to: %s' % _file_path)
+
+        self.file = open(_file_path, 'wb')
+        self.file.write(struct.pack(HEADER_FORMAT, SNAPSHOT_MAGIC, _bin_width))
+        self.interval = _interval
+        self.bin_width = _bin_width
+        self.next_time = None
+        self.previous_histogram = {}
+        self.number_of_snapshots = 0
+
+    def isDue(self, _unix_time):
+        """
+        :param _unix_time: (float) time of the last processed trade
+        :return: (bool) True if update would write a snapshot
+        """
+        return self.next_time is None or _unix_time >= self.next_time
+
+    def update(self, _unix_time, _bought):
+        """
+        Writes a snapshot if the interval has passed since the previous one.
+
+        :param _unix_time: (float) time of the last processed trade
+        :param _bought: (list) container holding all buying events: [(_trade_price, _traded_amount)]
+        :return: Nothing. Side effects: saves data to disk.
+        """
+        if not self.isDue(_unix_time):
+            return
+
+        histogram = _getHistogram(_bought, self.bin_width)
+        keyframe = self.number_of_snapshots % SNAPSHOT_KEYFRAME_EVERY == 0
+
+        if keyframe:
+            levels = histogram.items()
+        else:
+            #changed and new price levels, removed ones with zero volume
+            levels = [(level, volume) for level, volume in histogram.iteritems()
+                      if self.previous_histogram.get(level) != volume]
+            levels.extend((level, 0.0) for level in self.previous_histogram if level not in histogram)
+
+        self.file.write(struct.pack(RECORD_FORMAT, _unix_time, keyframe, len(levels)))
+        if levels:
+            self.file.write(struct.pack('=' + LEVEL_FORMAT * len(levels),
+                                        *[value for level in levels for value in level]))
+
+        self.previous_histogram = histogram
+        self.number_of_snapshots += 1
+        self.next_time = _unix_time + self.interval
+
+    def close(self):
+        logger.info('BookSnapshotWriter: Wrote %s snapshots.' % self.number_of_snapshots)
+        self.file.close()
+
+
+class BookSnapshotReader(object):
+    """
+    Rebuilds the book at any time from a snapshot file.
+
+    Only record headers are read when opening, book contents are read on request.
+    """
+
+    def __init__(self, _file_path):
+        logger.info('BookSnapshotReader: Indexing book snapshots: %s' % _file_path)
+
+        self.file = open(_file_path, 'rb')
+        magic, self.bin_width = struct.unpack(HEADER_FORMAT, self.file.read(struct.calcsize(HEADER_FORMAT)))
+
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError('Not a book snapshot file.')
+
+        #index: holds time, file offset and the keyframe of every snapshot
+        self.times = []
+        self.offsets = []
+        self.keyframes = []
+
+        record_size = struct.calcsize(RECORD_FORMAT)
+        level_size = struct.calcsize('=' + LEVEL_FORMAT)
+        keyframe_index = 0
+
+        while True:
+            offset = self.file.tell()
+            record = self.file.read(record_size)
+            if len(record) < record_size:
+                break
+
+            unix_time, keyframe, number_of_levels = struct.unpack(RECORD_FORMAT, record)
+            if keyframe:
+                keyframe_index = len(self.times)
+
+            self.times.append(unix_time)
+            self.offsets.append(offset)
+            self.keyframes.append(keyframe_index)
+
+            self.file.seek(number_of_levels * level_size, 1)
+
+    def getTimes(self):
+        """
+        :return: (list) times of all snapshots
+        """
+        return list(self.times)
+
+    def getBook(self, _unix_time):
+        """
+        Rebuilds the book as of the latest snapshot at or before _unix_time.
+
+        :param _unix_time: (float) requested time
+        :return: (list) [(price level, volume)] ordered by price, empty before the first snapshot
+        """
+        index = bisect.bisect_right(self.times, _unix_time) - 1
+        if index < 0:
+            return []
+
+        record_size = struct.calcsize(RECORD_FORMAT)
+        histogram = {}
+
+        #snapshots from the keyframe on are stored one after another
+        self.file.seek(self.offsets[self.keyframes[index]])
+        for i in xrange(self.keyframes[index], index + 1):
+            unix_time, keyframe, number_of_levels = struct.unpack(RECORD_FORMAT, self.file.read(record_size))
+            values = struct.unpack('=' + LEVEL_FORMAT * number_of_levels,
+                                   self.file.read(number_of_levels * struct.calcsize('=' + LEVEL_FORMAT)))
+
+            for level, volume in zip(values[0::2], values[1::2]):
+                if volume:
+                    histogram[level] = volume
+                else:
+                    histogram.pop(level, None)
+
+        return [(level * self.bin_width, histogram[level]) for level in sorted(histogram)]
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+"""
+Local stand-in for bitcoincharts.com and the exchange rate service.
+
+Serves markets.json, trades.csv?symbol=&start= and the calculator rate endpoint from synthetic or recorded data, with
+configurable latency, bandwidth, error injection and payload size. Used to benchmark and test the database build
+without hitting the real services.
+"""
+
+import BaseHTTPServer
+import SocketServer
+import bisect
+import json
+import logging
+import os
+import random
+import threading
+import time
+import urlparse
+
+logger = logging.getLogger(__name__)
+STANDIN_HOST = '127.0.0.1'
+PATH_MARKETS = '/t/markets.json'
+PATH_TRADES = '/t/trades.csv'
+PATH_CALCULATOR = '/ig/calculator'
+#chunk size used when throttling bandwidth
+WRITE_CHUNK_SIZE = 16384
+SYNTHETIC_CURRENCIES = ['USD', 'EUR', 'GBP', 'JPY', 'PLN', 'AUD', 'CAD', 'CHF']
+#default stand-in configuration
+DEFAULT_CONFIG = {
+    #seconds added to every response
+    'latency': 0.0,
+    #bytes per second, 0 for unlimited
+    'bandwidth': 0,
+    #probability of answering with HTTP 503
+    'error_rate': 0.0,
+    #probability of the calculator answering with a non-empty error field
+    'rate_error_rate': 0.0,
+    #number of synthetic markets
+    'number_of_markets': 8,
+    #number of trades per synthetic market
+    'trades_per_market': 10000,
+    #folder with recorded <market>.json files to serve instead of synthetic data, None for synthetic data
+    'recorded_folder': None,
+    'seed': 0,
+}
+
+
+def _getSyntheticTrades(_market, _number_of_trades, _seed):
+    """
+    Generates a random walk of trades for a market.
+
+    :param _market: (string) market name
+    :param _number_of_trades: (int) number of trades
+    :param _seed: (int) random seed
+    :return: (list) trades: [unix time, trade price, trade amount]
+    """
+    try:
+        generator = random.Random('%s%s' % (_seed, _market))
+        unix_time = 1300000000
+        price = 5.0 + generator.random() * 10
+
+        trades = []
+        for i in xrange(_number_of_trades):
+            unix_time += generator.randint(0, 120)
+            price = max(0.01, price * (1 + generator.gauss(0, 0.002)))
+            trades.append([unix_time, price, generator.expovariate(1.0)])
+
+        return trades
+
+    except:
+        raise
+
+
+class _StandinData(object):
+    """
+    Markets and trades served by the stand-in, generated or loaded once.
+
+    Trades of every market are kept as CSV lines ordered by time, with their times alongside for answering the start
+    parameter.
+    """
+
+    def __init__(self, _config):
+        self.config = _config
+        #trades: holds {market: (times, CSV lines)}
+        self.trades = {}
+
+        if _config['recorded_folder'] is not None:
+            for file_name in sorted(os.listdir(_config['recorded_folder'])):
+                if file_name.endswith('.json'):
+                    with open(_config['recorded_folder'] + '/' + file_name, 'r') as f:
+                        self._addMarket(file_name[:-len('.json')], json.load(f))
+        else:
+            for i in xrange(_config['number_of_markets']):
+                market = 'standin%s%s' % (i, SYNTHETIC_CURRENCIES[i % len(SYNTHETIC_CURRENCIES)])
+                self._addMarket(market, _getSyntheticTrades(market, _config['trades_per_market'], _config['seed']))
+
+        self.markets = json.dumps([{'symbol': market, 'currency': market[-3:]} for market in sorted(self.trades)])
+
+    def _addMarket(self, _market, _data):
+        data = sorted(_data, key=lambda entry: entry[0])
+        self.trades[_market] = ([entry[0] for entry in data],
+                                ['%d,%.12f,%.12f' % (entry[0], entry[1], entry[2]) for entry in data])
+
+    def getTrades(self, _market, _start):
+        """
+        :param _market: (string) market name
+        :param _start: (float) earliest trade time to serve
+        :return: (string) trades of the market since _start in bitcoincharts CSV format
+        """
+        times, lines = self.trades[_market]
+
+        return '\n'.join(lines[bisect.bisect_left(times, _start):])
+
+
+class _StandinHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Answers requests like the real services would.
+    """
+
+    def do_GET(self):
+        config = self.server.config
+        url = urlparse.urlparse(self.path)
+        query = urlparse.parse_qs(url.query)
+
+        time.sleep(config['latency'])
+
+        if random.random() < config['error_rate']:
+            self.send_error(503)
+            return
+
+        if url.path == PATH_MARKETS:
+            self._send(self.server.data.markets, 'application/json')
+
+        elif url.path == PATH_TRADES:
+            market = query.get('symbol', [''])[0]
+            if market not in self.server.data.trades:
+                self.send_error(404)
+                return
+
+            try:
+                start = float(query.get('start', ['0'])[0] or 0)
+            except ValueError:
+                self.send_error(400)
+                return
+
+            self._send(self.server.data.getTrades(market, start), 'text/plain')
+
+        elif url.path == PATH_CALCULATOR:
+            if random.random() < config['rate_error_rate']:
+                self._send('{lhs: "",rhs: "",error: "4",icc: false}', 'text/plain')
+            else:
+                #any rate will do, keep it stable per currency
+                rate = 0.5 + random.Random(query.get('q', [''])[0]).random()
+                self._send('{lhs: "1",rhs: "%.6f U.S. dollars",error: "",icc: true}' % rate, 'text/plain')
+
+        else:
+            self.send_error(404)
+
+    def _send(self, _body, _content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', _content_type)
+        self.send_header('Content-Length', str(len(_body)))
+        self.end_headers()
+
+        bandwidth = self.server.config['bandwidth']
+        for start in xrange(0, len(_body), WRITE_CHUNK_SIZE):
+            chunk = _body[start:start + WRITE_CHUNK_SIZE]
+            self.wfile.write(chunk)
+
+            if bandwidth:
+                time.sleep(float(len(chunk)) / bandwidth)
+
+        with self.server.lock:
+            self.server.bytes_served += len(_body)
+
+    def log_message(self, _format, *args):
+        logger.debug('StandinHandler: ' + _format % args)
+
+
+class _StandinServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def startStandinServer(_config=None, _port=0):
+    """
+    Starts the stand-in server in a background thread.
+
+    :param _config: (dict) overrides of DEFAULT_CONFIG
+    :param _port: (int) port to listen on, 0 for any free port
+    :return: (object) server; server.bytes_served counts payload bytes sent so far
+    """
+    try:
+        config = dict(DEFAULT_CONFIG)
+        config.update(_config or {})
+        logger.info('startStandinServer: Starting stand-in server: %s' % config)
+
+        server = _StandinServer((STANDIN_HOST, _port), _StandinHandler)
+        server.config = config
+        server.data = _StandinData(config)
+        server.bytes_served = 0
+        server.lock = threading.Lock()
+
+        server_thread = threading.Thread(target=server.serve_forever, name='standin-server')
+        server_thread.daemon = True
+        server_thread.start()
+
+        return server
+
+    except:
+        raise
+
+
+def getStandinUrls(_server):
+    """
+    Retrieves stand-in URLs matching lib.database.URL_EXCHANGES, URL_TRADES and lib.network.URL_CALCULATOR.
+
+    :param _server: (object) server returned by startStandinServer
+    :return: (dict) {'exchanges': string, 'trades': string, 'calculator': string}
+    """
+    try:
+        base_url = 'http://%s:%s' % _server.server_address
+
+        return {
+            'exchanges': base_url + PATH_MARKETS,
+            'trades': base_url + PATH_TRADES + '?symbol=',
+            'calculator': base_url + PATH_CALCULATOR + '?hl=en&q=',
+        }
+
+    except:
+        raise
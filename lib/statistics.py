@@ -19,7 +19,7 @@ def getGlobalStatistics(_trade_price, _future_trade_price, _forecasted_volume, _
     :return: (map) global statistics
     """
     try:
-        logger.info('getGlobalStatistics: Calculating global statistics.')
+        logger.debug('getGlobalStatistics: Calculating global statistics.')
 
         #1 if prediction succesfull, -1 if prediction wrong, 0 if no info
         did_not_sell = did_sell = 0
@@ -85,7 +85,7 @@ def getLocalStatistics(_current_response):
     :return: (map) local statistics
     """
     try:
-        logger.info('getLocalStatistics: Calculating local statistics.')
+        logger.debug('getLocalStatistics: Calculating local statistics.')
 
         #set up temporary window size
         window_tmp = WINDOW_SIZE
@@ -0,0 +1,599 @@
+# -*- coding: utf-8 -*-
+
+"""
+Parameter sweeps distributed over worker processes.
+
+A coordinator hands out (dataset, window, greed) tasks to workers on one or many hosts, either over a TCP socket
+(line delimited JSON, one request per connection) or through a shared directory (tasks are claimed by atomically
+renaming their file). Workers send heartbeats while simulating; tasks whose worker stops sending heartbeats are handed
+out again, up to MAXIMUM_ATTEMPTS times.
+
+Shared directory layout: pending/<task id>.json, running/<task id>.<worker id>.json (heartbeat: counter in the file,
+timed by the coordinator's clock only, so clocks of the hosts need not agree), results/<task id>.json.
+"""
+
+import SocketServer
+import collections
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import traceback
+import lib.agents as agents
+import lib.evaluation as evaluation
+
+logger = logging.getLogger(__name__)
+#seconds between heartbeats of a worker
+HEARTBEAT_INTERVAL = 5
+#seconds without heartbeat after which a task is considered lost
+HEARTBEAT_TIMEOUT = 30
+MAXIMUM_ATTEMPTS = 3
+#seconds a worker waits before asking again when all remaining tasks are running
+POLL_INTERVAL = 1
+SOCKET_TIMEOUT = 60
+#seconds a coordinator keeps answering after the last task so waiting workers learn they are done
+SHUTDOWN_GRACE_PERIOD = 3
+
+
+def getSweepTasks(_datasets, _windows, _greeds):
+    """
+    Builds tasks for every combination of dataset, window and greed.
+
+    :param _datasets: (list) paths of market data files
+    :param _windows: (list) trade index ranges [start, end], None for the whole dataset
+    :param _greeds: (list) greeds or greed histograms [(greed, weight)]
+    :return: (list) tasks: [{'task_id': string, 'dataset': string, 'window': list, 'greed': float or list}]
+    """
+    try:
+        tasks_ = []
+
+        for dataset in _datasets:
+            for window in _windows:
+                for greed in _greeds:
+                    tasks_.append({'task_id': str(len(tasks_)), 'dataset': dataset, 'window': window,
+                                   'greed': greed})
+
+        return tasks_
+
+    except:
+        raise
+
+
+##########################
+#coordinator over TCP
+##########################
+class SweepCoordinator(object):
+    """
+    Keeps track of pending, running, finished and failed tasks.
+    """
+
+    def __init__(self, _tasks, _heartbeat_timeout=HEARTBEAT_TIMEOUT, _maximum_attempts=MAXIMUM_ATTEMPTS):
+        self.lock = threading.Lock()
+        self.tasks = dict((task['task_id'], task) for task in _tasks)
+        self.pending = collections.deque(task['task_id'] for task in _tasks)
+        #running: holds {task id: {'worker': string, 'heartbeat': float}}
+        self.running = {}
+        self.attempts = dict.fromkeys(self.tasks, 0)
+        self.results = {}
+        self.failed = {}
+        self.heartbeat_timeout = _heartbeat_timeout
+        self.maximum_attempts = _maximum_attempts
+
+    def _retry(self, _task_id, _reason):
+        del self.running[_task_id]
+
+        if self.attempts[_task_id] >= self.maximum_attempts:
+            logger.error('SweepCoordinator: Task %s failed: %s' % (_task_id, _reason))
+            self.failed[_task_id] = _reason
+        else:
+            logger.warning('SweepCoordinator: Retrying task %s: %s' % (_task_id, _reason))
+            self.pending.append(_task_id)
+
+    def _requeueLost(self):
+        now = time.time()
+
+        for task_id, state in self.running.items():
+            if now - state['heartbeat'] > self.heartbeat_timeout:
+                self._retry(task_id, 'worker %s lost' % state['worker'])
+
+    def isFinished(self):
+        with self.lock:
+            self._requeueLost()
+            return not self.pending and not self.running
+
+    def handle(self, _message):
+        """
+        Answers a worker message.
+
+        :param _message: (dict) {'type': 'request' | 'heartbeat' | 'result', 'worker': string, ...}
+        :return: (dict) reply
+        """
+        with self.lock:
+            self._requeueLost()
+            message_type = _message['type']
+            worker = _message['worker']
+
+            if message_type == 'request':
+                if self.pending:
+                    task_id = self.pending.popleft()
+                    self.attempts[task_id] += 1
+                    self.running[task_id] = {'worker': worker, 'heartbeat': time.time()}
+                    return {'type': 'task', 'task': self.tasks[task_id]}
+
+                #lost running tasks may still come back
+                return {'type': 'wait' if self.running else 'done'}
+
+            task_id = _message['task_id']
+            state = self.running.get(task_id)
+
+            if message_type == 'heartbeat':
+                if state is not None and state['worker'] == worker:
+                    state['heartbeat'] = time.time()
+                return {'type': 'ok'}
+
+            if message_type == 'result':
+                #a late result of a task handed out again is still valid
+                if task_id not in self.results and task_id not in self.failed:
+                    if 'error' in _message['result']:
+                        if state is not None and state['worker'] == worker:
+                            self._retry(task_id, _message['result']['error'])
+                    else:
+                        self.results[task_id] = _message['result']
+                        self.running.pop(task_id, None)
+                        if task_id in self.pending:
+                            self.pending.remove(task_id)
+                return {'type': 'ok'}
+
+            raise ValueError('Unknown message type: %s' % message_type)
+
+
+class _CoordinatorHandler(SocketServer.StreamRequestHandler):
+    """
+    Reads one JSON message per connection and writes the reply.
+    """
+
+    def handle(self):
+        try:
+            message = json.loads(self.rfile.readline())
+            reply = self.server.coordinator.handle(message)
+        except Exception, e:
+            logger.exception('CoordinatorHandler: Unhandled exception: ')
+            reply = {'type': 'error', 'error': str(e)}
+
+        self.wfile.write(json.dumps(reply) + '\n')
+
+
+class _CoordinatorServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def startTcpCoordinator(_coordinator, _host='127.0.0.1', _port=0):
+    """
+    Serves a coordinator over TCP in a background thread.
+
+    :param _coordinator: (object) SweepCoordinator
+    :param _host: (string) address to listen on, '0.0.0.0' to accept workers from other hosts
+    :param _port: (int) port to listen on, 0 for any free port
+    :return: (object) server; server.server_address is (host, port)
+    """
+    try:
+        logger.info('startTcpCoordinator: Starting coordinator on %s:%s' % (_host, _port))
+
+        server = _CoordinatorServer((_host, _port), _CoordinatorHandler)
+        server.coordinator = _coordinator
+
+        server_thread = threading.Thread(target=server.serve_forever, name='sweep-coordinator')
+        server_thread.daemon = True
+        server_thread.start()
+
+        return server
+
+    except:
+        raise
+
+
+class _TcpTransport(object):
+    """
+    Worker side of the TCP coordinator.
+    """
+
+    def __init__(self, _host, _port, _worker_id):
+        self.address = (_host, _port)
+        self.worker_id = _worker_id
+
+    def _send(self, _message):
+        _message['worker'] = self.worker_id
+        connection = socket.create_connection(self.address, SOCKET_TIMEOUT)
+
+        try:
+            connection.sendall(json.dumps(_message) + '\n')
+            reply = json.loads(connection.makefile('r').readline())
+        finally:
+            connection.close()
+
+        if reply['type'] == 'error':
+            raise RuntimeError('Coordinator error: %s' % reply['error'])
+
+        return reply
+
+    def getTask(self):
+        reply = self._send({'type': 'request'})
+        return reply['type'], reply.get('task')
+
+    def heartbeat(self, _task):
+        self._send({'type': 'heartbeat', 'task_id': _task['task_id']})
+
+    def putResult(self, _task, _result):
+        self._send({'type': 'result', 'task_id': _task['task_id'], 'result': _result})
+
+
+##########################
+#coordinator over a shared directory
+##########################
+def _writeJson(_file_path, _data):
+    #write to a temporary file first so readers never see a partial file
+    tmp_file_path = _file_path + '.tmp'
+    with open(tmp_file_path, 'w') as f:
+        json.dump(_data, f)
+    os.rename(tmp_file_path, _file_path)
+
+
+def createDirectorySweep(_sweep_folder, _tasks):
+    """
+    Publishes tasks in a shared directory.
+
+    :param _sweep_folder: (string) shared folder, visible to all workers
+    :param _tasks: (list) tasks returned by getSweepTasks
+    :return: Nothing. Side effects: Writes data to disk.
+    """
+    try:
+        logger.info('createDirectorySweep: Publishing %s tasks in: %s' % (len(_tasks), _sweep_folder))
+
+        for sub_folder in ('pending', 'running', 'results'):
+            if not os.path.exists(_sweep_folder + '/' + sub_folder):
+                os.makedirs(_sweep_folder + '/' + sub_folder)
+
+        for task in _tasks:
+            task = dict(task, attempts=0)
+            _writeJson('%s/pending/%s.json' % (_sweep_folder, task['task_id']), task)
+
+    except:
+        raise
+
+
+def collectDirectoryResults(_sweep_folder, _heartbeat_timeout=HEARTBEAT_TIMEOUT, _maximum_attempts=MAXIMUM_ATTEMPTS):
+    """
+    Waits for all tasks of a directory sweep, handing out lost tasks again.
+
+    :param _sweep_folder: (string) shared folder
+    :param _heartbeat_timeout: (float) seconds without heartbeat after which a task is considered lost
+    :param _maximum_attempts: (int) number of times a task is handed out before it is failed
+    :return: (dict) {'results': {task id: result}, 'failed': {task id: reason}}
+    """
+    try:
+        logger.info('collectDirectoryResults: Collecting results from: %s' % _sweep_folder)
+
+        failed = {}
+        #heartbeats: holds {running file name: (last heartbeat, local time it was first seen)}
+        heartbeats = {}
+
+        while True:
+            now = time.time()
+            running_names = set()
+
+            for file_name in os.listdir(_sweep_folder + '/running'):
+                if file_name.endswith('.tmp'):
+                    continue
+
+                running_path = _sweep_folder + '/running/' + file_name
+                try:
+                    with open(running_path, 'r') as f:
+                        task = json.load(f)
+                except (IOError, OSError, ValueError):
+                    #finished or reclaimed in the meantime
+                    continue
+
+                running_names.add(file_name)
+
+                #a newly claimed task or a new heartbeat restarts the timeout
+                heartbeat = (task['attempts'], task.get('heartbeat', 0))
+                if file_name not in heartbeats or heartbeats[file_name][0] != heartbeat:
+                    heartbeats[file_name] = (heartbeat, now)
+                    continue
+
+                if now - heartbeats[file_name][1] <= _heartbeat_timeout:
+                    continue
+
+                del heartbeats[file_name]
+                task_id = task['task_id']
+                if task['attempts'] >= _maximum_attempts:
+                    logger.error('collectDirectoryResults: Task %s failed: worker lost' % task_id)
+                    failed[task_id] = 'worker lost'
+                    os.remove(running_path)
+                else:
+                    logger.warning('collectDirectoryResults: Retrying task %s: worker lost' % task_id)
+                    _writeJson('%s/pending/%s.json' % (_sweep_folder, task_id), task)
+                    os.remove(running_path)
+
+            #forget finished tasks
+            for file_name in heartbeats.keys():
+                if file_name not in running_names:
+                    del heartbeats[file_name]
+
+            #errors reported by workers
+            for file_name in os.listdir(_sweep_folder + '/results'):
+                if file_name.endswith('.error'):
+                    with open(_sweep_folder + '/results/' + file_name, 'r') as f:
+                        failed[file_name[:-len('.error')]] = f.read()
+
+            pending = [name for name in os.listdir(_sweep_folder + '/pending') if not name.endswith('.tmp')]
+            running = [name for name in os.listdir(_sweep_folder + '/running') if not name.endswith('.tmp')]
+
+            if not pending and not running:
+                break
+
+            time.sleep(POLL_INTERVAL)
+
+        results = {}
+        for file_name in os.listdir(_sweep_folder + '/results'):
+            if file_name.endswith('.json'):
+                with open(_sweep_folder + '/results/' + file_name, 'r') as f:
+                    results[file_name[:-len('.json')]] = json.load(f)
+
+        for task_id in results:
+            failed.pop(task_id, None)
+
+        return {'results': results, 'failed': failed}
+
+    except:
+        raise
+
+
+class _DirectoryTransport(object):
+    """
+    Worker side of a shared directory sweep.
+    """
+
+    def __init__(self, _sweep_folder, _worker_id):
+        self.folder = _sweep_folder
+        self.worker_id = _worker_id
+        self.running_path = None
+
+    def getTask(self):
+        for file_name in sorted(os.listdir(self.folder + '/pending')):
+            if not file_name.endswith('.json'):
+                continue
+
+            task_id = file_name[:-len('.json')]
+            running_path = '%s/running/%s.%s.json' % (self.folder, task_id, self.worker_id)
+
+            #rename is atomic: only one worker gets the task
+            try:
+                os.rename(self.folder + '/pending/' + file_name, running_path)
+            except OSError:
+                continue
+
+            try:
+                with open(running_path, 'r') as f:
+                    task = json.load(f)
+
+                #a lost task may have finished after all
+                if os.path.exists('%s/results/%s.json' % (self.folder, task_id)):
+                    os.remove(running_path)
+                    continue
+
+                task['attempts'] += 1
+                task['heartbeat'] = 0
+                _writeJson(running_path, task)
+            except (IOError, OSError, ValueError):
+                #handed out again by the coordinator in the meantime
+                logger.warning('DirectoryTransport: Lost claimed task %s.' % task_id)
+                continue
+
+            self.running_path = running_path
+
+            return 'task', task
+
+        if [name for name in os.listdir(self.folder + '/running') if not name.endswith('.tmp')]:
+            return 'wait', None
+
+        return 'done', None
+
+    def heartbeat(self, _task):
+        #the task was handed out again when the file is gone, the result is still welcome
+        if os.path.exists(self.running_path):
+            _task['heartbeat'] += 1
+            _writeJson(self.running_path, _task)
+
+    def putResult(self, _task, _result):
+        task_id = _task['task_id']
+
+        if 'error' in _result:
+            #lost task handling retries it after the heartbeat timeout when attempts are left
+            if _task['attempts'] >= MAXIMUM_ATTEMPTS:
+                with open('%s/results/%s.error' % (self.folder, task_id), 'w') as f:
+                    f.write(_result['error'])
+                self._release()
+            return
+
+        _writeJson('%s/results/%s.json' % (self.folder, task_id), _result)
+        self._release()
+
+    def _release(self):
+        try:
+            os.remove(self.running_path)
+        except OSError:
+            pass
+        self.running_path = None
+
+
+##########################
+#worker
+##########################
+def _runTask(_task, _datasets):
+    """
+    Simulates one task and summarizes the prediction outcomes.
+
+    :param _task: (dict) task
+    :param _datasets: (dict) loaded datasets: {path: data}
+    :return: (dict) {'task_id': string, 'size': int, 'seconds': float, 'metrics': dict}
+    """
+    try:
+        logger.info('runTask: Running task: %s' % _task)
+
+        dataset = _task['dataset']
+        if dataset not in _datasets:
+            with open(dataset, 'r') as f:
+                _datasets[dataset] = json.load(f)
+
+        data = _datasets[dataset]
+        if _task['window'] is not None:
+            start, end = _task['window']
+            data = data[start:end]
+
+        #JSON turns greed histogram tuples into lists
+        greed = _task['greed']
+        if isinstance(greed, list):
+            greed = [tuple(bucket) for bucket in greed]
+
+        start_time = time.time()
+        outcomes = evaluation.getPredictionOutcomes(agents.iterateAgentReactions(data, greed))
+
+        metrics = evaluation.getMetrics(outcomes, _rolling_metrics=[], _rolling_windows=[], _group_by=[])
+
+        return {'task_id': _task['task_id'], 'size': len(outcomes['energy_in']), 'seconds': time.time() - start_time,
+                'metrics': metrics['global']}
+
+    except:
+        raise
+
+
+def _sendHeartbeats(_transport, _task, _stop):
+    while not _stop.wait(HEARTBEAT_INTERVAL):
+        try:
+            _transport.heartbeat(_task)
+        except Exception:
+            logger.exception('sendHeartbeats: Unhandled exception: ')
+
+
+def _runWorker(_transport):
+    """
+    Pulls and runs tasks until the coordinator has none left.
+
+    :param _transport: (object) _TcpTransport or _DirectoryTransport
+    :return: (int) number of tasks run
+    """
+    try:
+        logger.info('runWorker: Worker %s started.' % _transport.worker_id)
+
+        datasets = {}
+        number_of_tasks = 0
+
+        while True:
+            try:
+                reply_type, task = _transport.getTask()
+            except socket.error, e:
+                #the coordinator is gone once all tasks are done
+                logger.warning('runWorker: Coordinator not reachable, stopping: %s' % e)
+                break
+
+            if reply_type == 'done':
+                break
+
+            if reply_type == 'wait':
+                time.sleep(POLL_INTERVAL)
+                continue
+
+            stop = threading.Event()
+            heartbeat_thread = threading.Thread(target=_sendHeartbeats, args=(_transport, task, stop),
+                                                name='sweep-heartbeat')
+            heartbeat_thread.daemon = True
+            heartbeat_thread.start()
+
+            try:
+                result = _runTask(task, datasets)
+            except Exception:
+                logger.exception('runWorker: Task %s failed: ' % task['task_id'])
+                result = {'task_id': task['task_id'], 'error': traceback.format_exc()}
+            finally:
+                stop.set()
+                heartbeat_thread.join()
+
+            result['worker'] = _transport.worker_id
+            _transport.putResult(task, result)
+            number_of_tasks += 1
+
+        logger.info('runWorker: Worker %s finished after %s tasks.' % (_transport.worker_id, number_of_tasks))
+
+        return number_of_tasks
+
+    except:
+        raise
+
+
+def _getWorkerId():
+    return '%s-%s' % (socket.gethostname(), os.getpid())
+
+
+def runTcpWorker(_host, _port, _worker_id=None):
+    """
+    Runs a worker pulling tasks from a TCP coordinator.
+
+    :param _host: (string) coordinator address
+    :param _port: (int) coordinator port
+    :param _worker_id: (string) worker name, host name and process id by default
+    :return: (int) number of tasks run
+    """
+    return _runWorker(_TcpTransport(_host, _port, _worker_id or _getWorkerId()))
+
+
+def runDirectoryWorker(_sweep_folder, _worker_id=None):
+    """
+    Runs a worker pulling tasks from a shared directory.
+
+    :param _sweep_folder: (string) shared folder
+    :param _worker_id: (string) worker name, host name and process id by default
+    :return: (int) number of tasks run
+    """
+    return _runWorker(_DirectoryTransport(_sweep_folder, _worker_id or _getWorkerId()))
+
+
+def runLocalSweep(_tasks, _number_of_workers):
+    """
+    Runs a sweep with a TCP coordinator and worker processes on this host.
+
+    :param _tasks: (list) tasks returned by getSweepTasks
+    :param _number_of_workers: (int) number of worker processes
+    :return: (dict) {'results': {task id: result}, 'failed': {task id: reason}}
+    """
+    try:
+        logger.info('runLocalSweep: Running %s tasks on %s workers.' % (len(_tasks), _number_of_workers))
+
+        coordinator = SweepCoordinator(_tasks)
+        server = startTcpCoordinator(coordinator)
+        host, port = server.server_address
+
+        workers = [multiprocessing.Process(target=runTcpWorker, args=(host, port, 'local-%s' % i))
+                   for i in xrange(_number_of_workers)]
+        for worker in workers:
+            worker.start()
+
+        try:
+            while not coordinator.isFinished():
+                #all workers gone with tasks left: nobody will finish them
+                if not any(worker.is_alive() for worker in workers):
+                    break
+                time.sleep(POLL_INTERVAL)
+        finally:
+            for worker in workers:
+                worker.join()
+            server.shutdown()
+
+        return {'results': coordinator.results, 'failed': coordinator.failed}
+
+    except:
+        raise